@@ -1,7 +1,9 @@
 import asyncio
 import json
 import logging
-from collections.abc import AsyncIterator
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from functools import partial
 from typing import Any
 
 import aiohttp
@@ -10,6 +12,8 @@ from tenacity import before_sleep_log, retry, retry_if_exception_type, wait_fixe
 from botli_dataclasses import API_Challenge_Reponse, Challenge_Request
 from config import Config
 from enums import Decline_Reason, Variant
+from response_cache import Response_Cache
+from source_health import Source_Health_Monitor
 
 logger = logging.getLogger(__name__)
 BASIC_RETRY_CONDITIONS = {'retry': retry_if_exception_type((aiohttp.ClientError, TimeoutError)),
@@ -28,12 +32,22 @@ MOVE_RETRY_CONDITIONS = {'retry': retry_if_exception_type((aiohttp.ClientError,
                          'before_sleep': before_sleep_log(logger, logging.DEBUG)}
 
 
+class SourceUnavailableException(Exception):
+    pass
+
+
 class API:
     def __init__(self, config: Config) -> None:
         self.lichess_session = aiohttp.ClientSession(config.url, headers={'Authorization': f'Bearer {config.token}',
                                                                           'User-Agent': f'BotLi/{config.version}'},
                                                      timeout=aiohttp.ClientTimeout(total=5.0))
         self.external_session = aiohttp.ClientSession(headers={'User-Agent': f'BotLi/{config.version}'})
+        self.response_cache = (Response_Cache(config.online_moves.cache)
+                               if config.online_moves.cache.enabled else None)
+        self.source_health = Source_Health_Monitor()
+        self.inflight_requests: dict[bytes, asyncio.Task[dict[str, Any] | None]] = {}
+        self.online_requests = 0
+        self.coalesced_requests = 0
 
     async def __aenter__(self) -> 'API':
         return self
@@ -49,6 +63,59 @@ class API:
         await self.lichess_session.close()
         await self.external_session.close()
 
+        if self.response_cache:
+            self.response_cache.close()
+
+    async def _get_cached(self,
+                          source: str,
+                          params: dict[str, Any],
+                          fetch: Callable[[], Awaitable[tuple[dict[str, Any] | None, bool]]],
+                          is_miss: Callable[[dict[str, Any]], bool],
+                          budget: float
+                          ) -> dict[str, Any] | None:
+        if self.response_cache and (response := self.response_cache.get(source, params)):
+            return response
+
+        return await self._request(source, params, fetch, is_miss, budget)
+
+    async def _request(self,
+                       source: str,
+                       params: dict[str, Any],
+                       fetch: Callable[[], Awaitable[tuple[dict[str, Any] | None, bool]]],
+                       is_miss: Callable[[dict[str, Any]], bool],
+                       budget: float
+                       ) -> dict[str, Any] | None:
+        key = Response_Cache.get_key(source, params)
+        if request_task := self.inflight_requests.get(key):
+            self.online_requests += 1
+            self.coalesced_requests += 1
+            return await asyncio.shield(request_task)
+
+        if not self.source_health.is_available(source, budget):
+            raise SourceUnavailableException(source)
+
+        self.online_requests += 1
+        request_task = asyncio.create_task(self._fetch(source, params, fetch, is_miss))
+        self.inflight_requests[key] = request_task
+        request_task.add_done_callback(lambda _: self.inflight_requests.pop(key, None))
+        return await asyncio.shield(request_task)
+
+    async def _fetch(self,
+                     source: str,
+                     params: dict[str, Any],
+                     fetch: Callable[[], Awaitable[tuple[dict[str, Any] | None, bool]]],
+                     is_miss: Callable[[dict[str, Any]], bool]
+                     ) -> dict[str, Any] | None:
+        start_time = time.perf_counter()
+        response, is_complete = await fetch()
+        self.source_health.record(source, time.perf_counter() - start_time, response is not None)
+        if self.response_cache:
+            self.response_cache.record_fetch(source, time.perf_counter() - start_time)
+            if response is not None and is_complete:
+                self.response_cache.put(source, params, response, is_miss(response))
+
+        return response
+
     @retry(**BASIC_RETRY_CONDITIONS)
     async def abort_game(self, game_id: str) -> bool:
         try:
@@ -136,7 +203,17 @@ class API:
 
             return json_response
 
-    async def get_chessdb_eval(self, fen: str, timeout: int) -> dict[str, Any] | None:
+    async def get_chessdb_eval(self,
+                               fen: str,
+                               timeout: int,
+                               budget: float = float('inf')
+                               ) -> dict[str, Any] | None:
+        return await self._get_cached('chessdb', {'fen': fen},
+                                      partial(self._fetch_chessdb_eval, fen, timeout),
+                                      lambda response: response.get('status') != 'ok',
+                                      budget)
+
+    async def _fetch_chessdb_eval(self, fen: str, timeout: int) -> tuple[dict[str, Any] | None, bool]:
         try:
             async with self.external_session.get('http://www.chessdb.cn/cdb.php',
                                                  params={'action': 'queryall',
@@ -144,37 +221,72 @@ class API:
                                                          'json': 1},
                                                  timeout=aiohttp.ClientTimeout(total=timeout)) as response:
                 response.raise_for_status()
-                return await response.json()
+                return await response.json(), True
         except (aiohttp.ClientError, json.JSONDecodeError) as e:
             print(f'ChessDB: {e}')
         except TimeoutError:
             print(f'ChessDB: Timed out after {timeout} second(s).')
 
-    async def get_cloud_eval(self, fen: str, variant: Variant, timeout: int) -> dict[str, Any] | None:
+        return None, False
+
+    async def get_cloud_eval(self,
+                             fen: str,
+                             variant: Variant,
+                             timeout: int,
+                             budget: float = float('inf')
+                             ) -> dict[str, Any] | None:
+        return await self._get_cached('lichess_cloud', {'fen': fen, 'variant': variant.value},
+                                      partial(self._fetch_cloud_eval, fen, variant, timeout),
+                                      lambda response: 'error' in response,
+                                      budget)
+
+    async def _fetch_cloud_eval(self,
+                                fen: str,
+                                variant: Variant,
+                                timeout: int
+                                ) -> tuple[dict[str, Any] | None, bool]:
         try:
             async with self.lichess_session.get('/api/cloud-eval', params={'fen': fen,
                                                                            'variant': variant.value},
                                                 timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status == 404:
+                    return {'error': 'No cloud evaluation available.'}, True
+
                 response.raise_for_status()
-                return await response.json()
+                return await response.json(), True
         except (aiohttp.ClientError, json.JSONDecodeError) as e:
             print(f'Cloud: {e}')
         except TimeoutError:
             print(f'Cloud: Timed out after {timeout} second(s).')
 
-    async def get_egtb(self, fen: str, variant: str, timeout: int) -> dict[str, Any] | None:
+        return None, False
+
+    async def get_egtb(self,
+                       fen: str,
+                       variant: str,
+                       timeout: int,
+                       budget: float = float('inf')
+                       ) -> dict[str, Any] | None:
+        return await self._get_cached('online_egtb', {'fen': fen, 'variant': variant},
+                                      partial(self._fetch_egtb, fen, variant, timeout),
+                                      lambda _: False,
+                                      budget)
+
+    async def _fetch_egtb(self, fen: str, variant: str, timeout: int) -> tuple[dict[str, Any] | None, bool]:
         try:
             async with self.external_session.get(f'https://tablebase.lichess.ovh/{variant}',
                                                  params={'fen': fen},
                                                  timeout=aiohttp.ClientTimeout(total=timeout)) as response:
 
                 response.raise_for_status()
-                return await response.json()
+                return await response.json(), True
         except (aiohttp.ClientError, json.JSONDecodeError) as e:
             print(f'EGTB: {e}')
         except TimeoutError:
             print(f'EGTB: Timed out after {timeout} second(s).')
 
+        return None, False
+
     @retry(**JSON_RETRY_CONDITIONS)
     async def get_event_stream(self, queue: asyncio.Queue[dict[str, Any]]) -> None:
         async with self.lichess_session.get('/api/stream/event',
@@ -203,8 +315,47 @@ class API:
                                    variant: Variant,
                                    color: str,
                                    speeds: str,
-                                   timeout: int
+                                   timeout: int,
+                                   budget: float = float('inf'),
+                                   use_cache: bool = True
                                    ) -> dict[str, Any] | None:
+        request = self._get_cached if use_cache else self._request
+        return await request('opening_explorer',
+                             self._get_opening_explorer_params(username, fen, variant, color, speeds),
+                             partial(self._fetch_opening_explorer, username, fen, variant, color, speeds, timeout),
+                             lambda response: not response['white'] + response['draws'] + response['black'],
+                             budget)
+
+    def get_cached_opening_explorer(self,
+                                    username: str,
+                                    fen: str,
+                                    variant: Variant,
+                                    color: str,
+                                    speeds: str
+                                    ) -> dict[str, Any] | None:
+        if not self.response_cache:
+            return
+
+        return self.response_cache.get('opening_explorer',
+                                       self._get_opening_explorer_params(username, fen, variant, color, speeds))
+
+    @staticmethod
+    def _get_opening_explorer_params(username: str,
+                                     fen: str,
+                                     variant: Variant,
+                                     color: str,
+                                     speeds: str) -> dict[str, Any]:
+        return {'player': username, 'variant': variant.value, 'fen': fen, 'color': color, 'speeds': speeds}
+
+    async def _fetch_opening_explorer(self,
+                                      username: str,
+                                      fen: str,
+                                      variant: Variant,
+                                      color: str,
+                                      speeds: str,
+                                      timeout: int
+                                      ) -> tuple[dict[str, Any] | None, bool]:
+        last_line = b''
         try:
             async with self.external_session.get('https://explorer.lichess.ovh/player',
                                                  params={'player': username, 'variant': variant.value,
@@ -214,12 +365,23 @@ class API:
                 response.raise_for_status()
                 async for line in response.content:
                     if line.strip():
-                        return json.loads(line)
+                        last_line = line
+
+                if last_line:
+                    return json.loads(last_line), True
         except (aiohttp.ClientError, json.JSONDecodeError) as e:
             print(f'Explore: {e}')
         except TimeoutError:
+            if last_line:
+                try:
+                    return json.loads(last_line), False
+                except json.JSONDecodeError:
+                    pass
+
             print(f'Explore: Timed out after {timeout} second(s).')
 
+        return None, False
+
     @retry(**JSON_RETRY_CONDITIONS)
     async def get_token_scopes(self, token: str) -> str:
         async with self.lichess_session.post('/api/token/test', data=token) as response:
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import random
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from itertools import accumulate, groupby
+from typing import Literal
+
+import chess
+import chess.polyglot
+
+from configs import Opening_Books_Config
+
+BOOK_INDEX_DIR = '.book_indexes'
+BOOK_INDEX_MAGIC = b'BOTLIDX2'
+HEADER_STRUCT = struct.Struct('<8sQ')
+INDEX_ENTRY_STRUCT = struct.Struct('<HHffI')
+BOOK_READ_ENTRIES = 4096
+STANDARD_CASTLING_SQUARES = {(chess.E1, chess.H1): chess.G1,
+                             (chess.E1, chess.A1): chess.C1,
+                             (chess.E8, chess.H8): chess.G8,
+                             (chess.E8, chess.A8): chess.C8}
+
+
+@dataclass
+class Book_Entry:
+    move: chess.Move
+    weight: float
+    learn: int
+
+
+@dataclass
+class Book_Position:
+    entries: list[Book_Entry] = field(default_factory=list)
+    cumulative_weights: list[float] = field(default_factory=list)
+
+    def select(self,
+               selection: Literal['weighted_random', 'uniform_random', 'best_move'],
+               is_excluded: Callable[[chess.Move], bool]
+               ) -> Book_Entry | None:
+        match selection:
+            case 'weighted_random':
+                excluded: set[int] = set()
+                while len(excluded) < len(self.entries):
+                    index = bisect_right(self.cumulative_weights, random.random() * self.cumulative_weights[-1])
+                    index = min(index, len(self.entries) - 1)
+                    if index in excluded:
+                        continue
+
+                    if not is_excluded(self.entries[index].move):
+                        return self.entries[index]
+
+                    excluded.add(index)
+            case 'uniform_random':
+                indices = list(range(len(self.entries)))
+                while indices:
+                    entry = self.entries[indices.pop(random.randrange(len(indices)))]
+                    if not is_excluded(entry.move):
+                        return entry
+            case 'best_move':
+                for entry in self.entries:
+                    if not is_excluded(entry.move):
+                        return entry
+
+
+class Book_Index:
+    def __init__(self, path: str, in_ram: bool) -> None:
+        if in_ram:
+            with open(path, 'rb') as index_file:
+                self.buffer: bytes | mmap.mmap = index_file.read()
+        else:
+            with open(path, 'rb') as index_file:
+                self.buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER_STRUCT.unpack_from(self.buffer)
+        if magic != BOOK_INDEX_MAGIC:
+            raise OSError(f'"{path}" is not a valid book index.')
+
+        self.path = path
+        self.in_ram = in_ram
+        self.size = len(self.buffer)
+        self.entries_offset = HEADER_STRUCT.size + 8 * count
+        self.keys = memoryview(self.buffer)[HEADER_STRUCT.size:self.entries_offset].cast('Q')
+
+    @staticmethod
+    def compile(book_paths: list[str], index_path: str) -> None:
+        books = [Book_Index._read_book(rank, path) for rank, path in enumerate(book_paths)]
+        keys = array('Q')
+        entries = bytearray()
+        for _, group in groupby(heapq.merge(*books), key=lambda entry: entry[:2]):
+            polyglot_entries = sorted(group, key=lambda entry: entry[3], reverse=True)
+            total_weight = sum(entry[3] for entry in polyglot_entries)
+            weights = [entry[3] / total_weight * 100.0 for entry in polyglot_entries]
+            weighted_entries = zip(polyglot_entries, weights, accumulate(weights))
+            for (key, rank, raw_move, _, learn), weight, cumulative_weight in weighted_entries:
+                keys.append(key)
+                entries += INDEX_ENTRY_STRUCT.pack(raw_move, rank, weight, cumulative_weight, learn)
+
+        temp_path = f'{index_path}.tmp'
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(HEADER_STRUCT.pack(BOOK_INDEX_MAGIC, len(keys)))
+            index_file.write(keys.tobytes())
+            index_file.write(entries)
+
+        os.replace(temp_path, index_path)
+
+    @staticmethod
+    def _read_book(rank: int, path: str) -> Iterator[tuple[int, int, int, int, int]]:
+        if os.path.getsize(path) % chess.polyglot.ENTRY_STRUCT.size:
+            raise OSError(f'Invalid file size: ensure "{path}" is a valid polyglot opening book.')
+
+        with open(path, 'rb') as book_file:
+            while data := book_file.read(BOOK_READ_ENTRIES * chess.polyglot.ENTRY_STRUCT.size):
+                for key, raw_move, weight, learn in chess.polyglot.ENTRY_STRUCT.iter_unpack(data):
+                    if weight:
+                        yield key, rank, raw_move, weight, learn
+
+    def find_all(self, board: chess.Board) -> dict[int, Book_Position]:
+        key = chess.polyglot.zobrist_hash(board)
+        start = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, start)
+
+        books: dict[int, Book_Position] = {}
+        for offset in range(self.entries_offset + start * INDEX_ENTRY_STRUCT.size,
+                            self.entries_offset + end * INDEX_ENTRY_STRUCT.size,
+                            INDEX_ENTRY_STRUCT.size):
+            raw_move, rank, weight, cumulative_weight, learn = INDEX_ENTRY_STRUCT.unpack_from(self.buffer, offset)
+            move = self._decode_move(board, raw_move)
+            if board.is_legal(move):
+                book_position = books.setdefault(rank, Book_Position())
+                book_position.entries.append(Book_Entry(move, weight, learn))
+                book_position.cumulative_weights.append(cumulative_weight)
+
+        return books
+
+    @staticmethod
+    def _decode_move(board: chess.Board, raw_move: int) -> chess.Move:
+        to_square = raw_move & 0x3f
+        from_square = (raw_move >> 6) & 0x3f
+        promotion_part = (raw_move >> 12) & 0x7
+        promotion = promotion_part + 1 if promotion_part else None
+
+        if from_square == to_square:
+            return chess.Move(from_square, to_square, drop=promotion)
+
+        if not board.chess960 and promotion is None and board.kings & chess.BB_SQUARES[from_square]:
+            to_square = STANDARD_CASTLING_SQUARES.get((from_square, to_square), to_square)
+
+        return chess.Move(from_square, to_square, promotion)
+
+    def close(self) -> None:
+        self.keys.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+
+class Book_Registry:
+    def __init__(self, max_ram_book_size: int | None) -> None:
+        self.max_ram_book_size = 0 if max_ram_book_size is None else max_ram_book_size * 1024 * 1024
+        self.indexes: dict[tuple[str, ...], tuple[str, Book_Index]] = {}
+        self.references: dict[Book_Index, int] = {}
+        self.load_tasks: dict[tuple[str, ...], asyncio.Task[None]] = {}
+        self.compilations = 0
+        self.reloads = 0
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    async def start(self, opening_books_config: Opening_Books_Config) -> None:
+        if not opening_books_config.enabled:
+            return
+
+        for books_config in opening_books_config.books.values():
+            await self.load(list(books_config.names.values()))
+
+        if os.path.isdir(BOOK_INDEX_DIR):
+            current_paths = {os.path.abspath(index.path) for index in self.references}
+            for name in os.listdir(BOOK_INDEX_DIR):
+                path = os.path.join(BOOK_INDEX_DIR, name)
+                if name.endswith('.idx') and os.path.abspath(path) not in current_paths:
+                    os.remove(path)
+
+    async def load(self, book_paths: list[str]) -> None:
+        key = tuple(book_paths)
+        if not (task := self.load_tasks.get(key)):
+            task = asyncio.create_task(self._load(book_paths))
+            task.add_done_callback(lambda _: self.load_tasks.pop(key, None))
+            self.load_tasks[key] = task
+
+        await task
+
+    async def _load(self, book_paths: list[str]) -> None:
+        index_key = self._get_index_key(book_paths)
+        current_index = self.indexes.get(tuple(book_paths))
+        if current_index:
+            if current_index[0] == index_key:
+                return
+
+            print('Opening book has changed on disk. Reloading ...')
+            self.reloads += 1
+
+        index_path = os.path.join(BOOK_INDEX_DIR, f'{index_key}.idx')
+        if not os.path.isfile(index_path):
+            print(f'Compiling book index for {len(book_paths)} book(s) ...')
+            os.makedirs(BOOK_INDEX_DIR, exist_ok=True)
+            await asyncio.to_thread(Book_Index.compile, book_paths, index_path)
+            self.compilations += 1
+
+        index = await asyncio.to_thread(Book_Index,
+                                        index_path,
+                                        os.path.getsize(index_path) <= self.max_ram_book_size)
+        self.indexes[tuple(book_paths)] = index_key, index
+        self.references[index] = 0
+
+        if current_index:
+            self._close_if_unused(current_index[1])
+
+    async def _reload(self, book_paths: list[str]) -> None:
+        try:
+            await self.load(book_paths)
+        except OSError as e:
+            print(f'Reloading opening book failed: {e}')
+
+    def acquire(self, book_paths: list[str]) -> Book_Index | None:
+        if tuple(book_paths) not in self.load_tasks:
+            asyncio.create_task(self._reload(book_paths))
+
+        if not (current_index := self.indexes.get(tuple(book_paths))):
+            return
+
+        self.references[current_index[1]] += 1
+        return current_index[1]
+
+    def release(self, index: Book_Index) -> None:
+        self.references[index] -= 1
+        self._close_if_unused(index)
+
+    def _close_if_unused(self, index: Book_Index) -> None:
+        if self.references[index] or any(index is current for _, current in self.indexes.values()):
+            return
+
+        del self.references[index]
+        index.close()
+        os.remove(index.path)
+
+    @staticmethod
+    def _get_index_key(book_paths: list[str]) -> str:
+        book_stats = []
+        for path in book_paths:
+            stat = os.stat(path)
+            book_stats.append([os.path.realpath(path), stat.st_mtime_ns, stat.st_size])
+
+        return hashlib.sha256(json.dumps([BOOK_INDEX_MAGIC.decode(), book_stats]).encode()).hexdigest()
+
+    def find_all(self, index: Book_Index, board: chess.Board) -> dict[int, Book_Position]:
+        start_time = time.perf_counter()
+        books = index.find_all(board)
+        self.lookups += 1
+        self.lookup_time += time.perf_counter() - start_time
+        return books
+
+    def close(self) -> None:
+        for task in list(self.load_tasks.values()):
+            task.cancel()
+
+        for index in self.references:
+            index.close()
+
+        self.indexes.clear()
+        self.references.clear()
+
+    @property
+    def average_lookup_time(self) -> float:
+        return self.lookup_time / self.lookups if self.lookups else 0.0
+
+    def __str__(self) -> str:
+        ram_count = sum(index.in_ram for _, index in self.indexes.values())
+        index_size = sum(index.size for _, index in self.indexes.values())
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Book registry: {len(self.indexes)} indexes ({index_size / 1024 / 1024:.1f} MB)',
+                               f'In RAM: {ram_count}',
+                               f'Compilations: {self.compilations}',
+                               f'Reloads: {self.reloads}',
+                               f'Lookups: {self.lookups}',
+                               f'Avg lookup: {self.average_lookup_time * 1_000_000:.0f} µs'))
@@ -5,8 +5,8 @@ from typing import Any, Literal
 
 import chess
 import chess.engine
-from chess.polyglot import MemoryMappedReader
 
+from book_registry import Book_Index
 from enums import Challenge_Color, Perf_Type, Variant
 
 
@@ -26,7 +26,8 @@ class API_Challenge_Reponse:
 class Book_Settings:
     selection: Literal['weighted_random', 'uniform_random', 'best_move'] = 'best_move'
     max_depth: int | None = None
-    readers: dict[str, MemoryMappedReader] = field(default_factory=dict)
+    names: list[str] = field(default_factory=list)
+    index: Book_Index | None = None
 
 
 @dataclass
@@ -46,6 +47,9 @@ class Bot:
 class Challenge:
     challenge_id: str
     opponent_username: str
+    color: str | None = None
+    variant: Variant | None = None
+    speed: str | None = None
 
     def __eq__(self, __o: object) -> bool:
         if isinstance(__o, Challenge):
@@ -271,11 +275,18 @@ class Move_Response:
     is_engine_move: bool = field(default=False, kw_only=True)
 
 
+@dataclass
+class Online_Result:
+    source: str
+    move_response: Move_Response | None = None
+    is_out_of_book: bool = False
+
+
 @dataclass
 class Syzygy_Result:
     moves: list[chess.Move]
     wdl: Literal[-2, -1, 0, 1, 2]
-    dtz: int
+    dtz: int | None
 
 
 @dataclass
@@ -9,8 +9,8 @@ import yaml
 
 from configs import (Books_Config, Challenge_Config, ChessDB_Config, Engine_Config, Gaviota_Config,
                      Lichess_Cloud_Config, Matchmaking_Config, Matchmaking_Type_Config, Messages_Config,
-                     Offer_Draw_Config, Online_EGTB_Config, Online_Moves_Config, Opening_Books_Config,
-                     Opening_Explorer_Config, Resign_Config, Syzygy_Config)
+                     Offer_Draw_Config, Online_Cache_Config, Online_EGTB_Config, Online_Moves_Config,
+                     Opening_Books_Config, Opening_Explorer_Config, Resign_Config, Resources_Config, Syzygy_Config)
 
 
 @dataclass
@@ -27,6 +27,7 @@ class Config:
     challenge: Challenge_Config
     matchmaking: Matchmaking_Config
     messages: Messages_Config
+    resources: Resources_Config
     whitelist: list[str]
     blacklist: list[str]
     version: str
@@ -55,6 +56,7 @@ class Config:
         challenge_config = cls._get_challenge_config(yaml_config['challenge'])
         matchmaking_config = cls._get_matchmaking_config(yaml_config['matchmaking'])
         messages_config = cls._get_messages_config(yaml_config['messages'] or {})
+        resources_config = cls._get_resources_config(yaml_config.get('resources') or {})
         whitelist = [string.lower() for string in yaml_config.get('whitelist') or []]
         blacklist = [string.lower() for string in yaml_config.get('blacklist') or []]
 
@@ -70,6 +72,7 @@ class Config:
                    challenge_config,
                    matchmaking_config,
                    messages_config,
+                   resources_config,
                    whitelist,
                    blacklist,
                    cls._get_version())
@@ -129,11 +132,21 @@ class Config:
                 raise RuntimeError(f'The engine "{settings["path"]}" doesnt have execute (x) permission. '
                                    f'Try: chmod +x {settings["path"]}')
 
+            if settings.get('info_level') not in [None, 'all', 'score_pv', 'final']:
+                raise TypeError(f'`engines` `{key}` subsection "info_level" must be one of '
+                                '"all", "score_pv" or "final".')
+
             engine_configs[key] = Engine_Config(settings['path'],
                                                 settings['ponder'],
                                                 settings['silence_stderr'],
                                                 settings.get('move_overhead_multiplier'),
-                                                settings['uci_options'] or {})
+                                                settings['uci_options'] or {},
+                                                settings.get('pool_size'),
+                                                settings.get('pool_timeout'),
+                                                settings.get('stable_depths'),
+                                                settings.get('stable_score_window'),
+                                                settings.get('ponder_hit_depth'),
+                                                settings.get('info_level'))
 
         return engine_configs
 
@@ -363,7 +376,35 @@ class Config:
         return Online_Moves_Config(Config._get_opening_explorer_config(online_moves_section['opening_explorer']),
                                    Config._get_lichess_cloud_config(online_moves_section['lichess_cloud']),
                                    Config._get_chessdb_config(online_moves_section['chessdb']),
-                                   Config._get_online_egtb_config(online_moves_section['online_egtb']))
+                                   Config._get_online_egtb_config(online_moves_section['online_egtb']),
+                                   Config._get_online_cache_config(online_moves_section.get('cache') or {}))
+
+    @staticmethod
+    def _get_online_cache_config(cache_section: dict[str, Any]) -> Online_Cache_Config:
+        cache_sections = [
+            ['enabled', bool | None, '"enabled" must be a bool.'],
+            ['max_size', int | None, '"max_size" must be an integer.'],
+            ['ttl', dict | None, '"ttl" must be a dictionary with indented keys followed by colons.'],
+            ['negative_ttl', int | None, '"negative_ttl" must be an integer.']]
+
+        for subsection in cache_sections:
+            if not isinstance(cache_section.get(subsection[0]), subsection[1]):
+                raise TypeError(f'`online_moves` `cache` field {subsection[2]}')
+
+        ttls = {'opening_explorer': 24, 'lichess_cloud': 168, 'chessdb': 168, 'online_egtb': 8760}
+        for source, ttl in (cache_section.get('ttl') or {}).items():
+            if source not in ttls:
+                raise RuntimeError(f'`online_moves` `cache` `ttl` has unknown source "{source}".')
+
+            if not isinstance(ttl, int):
+                raise TypeError(f'`online_moves` `cache` `ttl` field "{source}" must be an integer.')
+
+            ttls[source] = ttl
+
+        return Online_Cache_Config(cache_section.get('enabled', False),
+                                   cache_section.get('max_size') or 64,
+                                   ttls,
+                                   cache_section.get('negative_ttl') or 24)
 
     @staticmethod
     def _get_offer_draw_config(offer_draw_section: dict[str, Any]) -> Offer_Draw_Config:
@@ -498,6 +539,23 @@ class Config:
                                messages_section.get('greeting_spectators'),
                                messages_section.get('goodbye_spectators'))
 
+    @staticmethod
+    def _get_resources_config(resources_section: dict[str, Any]) -> Resources_Config:
+        resources_sections = [
+            ['max_memory', int | None, '"max_memory" must be an integer.'],
+            ['max_ram_book_size', int | None, '"max_ram_book_size" must be an integer.'],
+            ['preload_tablebase_pieces', int | None, '"preload_tablebase_pieces" must be an integer.'],
+            ['lock_tablebases', bool | None, '"lock_tablebases" must be a bool.']]
+
+        for subsection in resources_sections:
+            if not isinstance(resources_section.get(subsection[0]), subsection[1]):
+                raise TypeError(f'`resources` subsection {subsection[2]}')
+
+        return Resources_Config(resources_section.get('max_memory'),
+                                resources_section.get('max_ram_book_size'),
+                                resources_section.get('preload_tablebase_pieces'),
+                                resources_section.get('lock_tablebases', False))
+
     @staticmethod
     def _get_version() -> str:
         try:
@@ -9,6 +9,12 @@ class Engine_Config:
     silence_stderr: bool
     move_overhead_multiplier: float | None
     uci_options: dict[str, Any]
+    pool_size: int | None
+    pool_timeout: int | None
+    stable_depths: int | None
+    stable_score_window: int | None
+    ponder_hit_depth: int | None
+    info_level: Literal['all', 'score_pv', 'final'] | None
 
 
 @dataclass
@@ -86,12 +92,21 @@ class Online_EGTB_Config:
     timeout: int
 
 
+@dataclass
+class Online_Cache_Config:
+    enabled: bool
+    max_size: int
+    ttls: dict[str, int]
+    negative_ttl: int
+
+
 @dataclass
 class Online_Moves_Config:
     opening_explorer: Opening_Explorer_Config
     lichess_cloud: Lichess_Cloud_Config
     chessdb: ChessDB_Config
     online_egtb: Online_EGTB_Config
+    cache: Online_Cache_Config
 
 
 @dataclass
@@ -151,3 +166,11 @@ class Messages_Config:
     goodbye: str | None
     greeting_spectators: str | None
     goodbye_spectators: str | None
+
+
+@dataclass
+class Resources_Config:
+    max_memory: int | None
+    max_ram_book_size: int | None
+    preload_tablebase_pieces: int | None
+    lock_tablebases: bool
@@ -1,23 +1,74 @@
 import asyncio
 import os
+import random
 import subprocess
+import time
+from collections import defaultdict, deque
+from dataclasses import replace
+from typing import Literal
 
 import chess
 import chess.engine
+import psutil
 
 from configs import Engine_Config, Syzygy_Config
 
+MIN_EARLY_STOP_DEPTH = 10
+MIN_HASH_SIZE = 16
+MAX_MOVE_TIME_FACTOR = 5.0
+THREAD_HYSTERESIS = 0.8
+INFO_LEVELS = {'all': chess.engine.INFO_ALL,
+               'score_pv': chess.engine.INFO_SCORE | chess.engine.INFO_PV,
+               'final': chess.engine.INFO_SCORE}
+
+
+class Timed_Uci_Protocol(chess.engine.UciProtocol):
+    def __init__(self) -> None:
+        super().__init__()
+        self.output_time = 0.0
+
+    def pipe_data_received(self, fd: int, data: bytes | str) -> None:
+        start_time = time.thread_time()
+        super().pipe_data_received(fd, data)
+        self.output_time += time.thread_time() - start_time
+
 
 class Engine:
     def __init__(self,
                  transport: asyncio.SubprocessTransport,
-                 engine: chess.engine.UciProtocol,
-                 ponder: bool,
+                 engine: Timed_Uci_Protocol,
+                 engine_config: Engine_Config,
+                 syzygy_config: Syzygy_Config,
                  opponent: chess.engine.Opponent) -> None:
         self.transport = transport
         self.engine = engine
-        self.ponder = ponder
+        self.engine_config = engine_config
+        self.syzygy_config = syzygy_config
+        self.ponder = engine_config.ponder
         self.opponent = opponent
+        self.game = object()
+        self.requested_threads = int(engine_config.uci_options.get('Threads', 1))
+        self.hash_size = self.get_requested_hash_size(engine_config) or self._get_default_hash_size(engine)
+        self.threads: int | None = None
+        self.configured_threads = self.requested_threads
+        self.cpu_budget: 'CPU_Budget | None' = None
+        self.info_selector = INFO_LEVELS[engine_config.info_level or 'all']
+        self.own_time = float('inf')
+        self.ponder_fen: str | None = None
+        self.ponder_pv: list[chess.Move] = []
+        self.search_info: chess.engine.InfoDict = {}
+        self.time_saved = 0.0
+        self.total_time_saved = 0.0
+        self.ponder_analysis: chess.engine.AnalysisResult | None = None
+        self.ponder_task: asyncio.Task[None] | None = None
+        self.ponder_info: chess.engine.InfoDict = {}
+        self.ponder_board: chess.Board | None = None
+        self.ponder_result: Literal['hit', 'miss'] | None = None
+        self.is_ponder_move = False
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        self.ponder_time_saved = 0.0
+        self.searches = 0
 
     @classmethod
     async def from_config(cls,
@@ -26,87 +77,699 @@ class Engine:
                           opponent: chess.engine.Opponent) -> 'Engine':
         stderr = subprocess.DEVNULL if engine_config.silence_stderr else None
 
-        transport, engine = await chess.engine.popen_uci(engine_config.path, stderr=stderr)
+        transport, engine = await Timed_Uci_Protocol.popen(engine_config.path, stderr=stderr)
+        try:
+            await engine.initialize()
+        except BaseException:
+            transport.close()
+            raise
 
         await cls._configure_engine(engine, engine_config, syzygy_config)
         await engine.send_opponent_information(opponent=opponent)
 
-        return cls(transport, engine, engine_config.ponder, opponent)
+        return cls(transport, engine, engine_config, syzygy_config, opponent)
 
     @classmethod
     async def test(cls, engine_config: Engine_Config) -> None:
         stderr = subprocess.DEVNULL if engine_config.silence_stderr else None
 
         transport, engine = await chess.engine.popen_uci(engine_config.path, stderr=stderr)
-        await cls._configure_engine(engine, engine_config, Syzygy_Config(False, [], 0, False))
-        result = await engine.play(chess.Board(), chess.engine.Limit(time=0.1), info=chess.engine.INFO_ALL)
+        try:
+            await cls._configure_engine(engine, engine_config, Syzygy_Config(False, [], 0, False))
+            result = await engine.play(chess.Board(), chess.engine.Limit(time=0.1), info=chess.engine.INFO_NONE)
 
-        if not result.move:
-            raise RuntimeError('Engine could not make a move!')
+            if not result.move:
+                raise RuntimeError('Engine could not make a move!')
+
+            await engine.quit()
+        finally:
+            transport.close()
+
+    @staticmethod
+    def get_requested_hash_size(engine_config: Engine_Config) -> int:
+        return int(engine_config.uci_options.get('Hash', 0))
+
+    @staticmethod
+    def _get_default_hash_size(engine: chess.engine.UciProtocol) -> int:
+        if 'Hash' not in engine.options:
+            return 0
 
-        await engine.quit()
-        transport.close()
+        return int(engine.options['Hash'].default or 0)
 
     @staticmethod
     async def _configure_engine(engine: chess.engine.UciProtocol,
                                 engine_config: Engine_Config,
                                 syzygy_config: Syzygy_Config) -> None:
+        options: dict[str, chess.engine.ConfigValue] = {}
         for name, value in engine_config.uci_options.items():
             if chess.engine.Option(name, '', None, None, None, None).is_managed():
                 print(f'UCI option "{name}" ignored as it is managed by the bot.')
             elif name in engine.options:
-                await engine.configure({name: value})
+                options[name] = value
             else:
                 print(f'UCI option "{name}" ignored as it is not supported by the engine.')
 
-        if not syzygy_config.enabled:
-            return
+        options.update(Engine._get_syzygy_options(engine, engine_config, syzygy_config))
+        await engine.configure(options)
+
+    @staticmethod
+    def _get_syzygy_options(engine: chess.engine.UciProtocol,
+                            engine_config: Engine_Config,
+                            syzygy_config: Syzygy_Config) -> dict[str, chess.engine.ConfigValue]:
+        options: dict[str, chess.engine.ConfigValue] = {}
 
         if 'SyzygyPath' in engine.options and 'SyzygyPath' not in engine_config.uci_options:
-            delimiter = ';' if os.name == 'nt' else ':'
-            await engine.configure({'SyzygyPath': delimiter.join(syzygy_config.paths)})
+            if syzygy_config.enabled:
+                delimiter = ';' if os.name == 'nt' else ':'
+                options['SyzygyPath'] = delimiter.join(syzygy_config.paths)
+            else:
+                options['SyzygyPath'] = engine.options['SyzygyPath'].default
 
         if 'SyzygyProbeLimit' in engine.options and 'SyzygyProbeLimit' not in engine_config.uci_options:
-            await engine.configure({'SyzygyProbeLimit': syzygy_config.max_pieces})
+            if syzygy_config.enabled:
+                options['SyzygyProbeLimit'] = syzygy_config.max_pieces
+            else:
+                options['SyzygyProbeLimit'] = engine.options['SyzygyProbeLimit'].default
+
+        return options
 
     @property
     def name(self) -> str:
         return self.engine.id['name']
 
+    @property
+    def is_alive(self) -> bool:
+        return self.transport.get_returncode() is None
+
+    @property
+    def has_syzygy(self) -> bool:
+        if 'SyzygyPath' not in self.engine.options:
+            return False
+
+        return self.syzygy_config.enabled or 'SyzygyPath' in self.engine_config.uci_options
+
+    async def new_game(self, syzygy_config: Syzygy_Config, opponent: chess.engine.Opponent) -> None:
+        if syzygy_config != self.syzygy_config:
+            await self.engine.configure(self._get_syzygy_options(self.engine, self.engine_config, syzygy_config))
+            self.syzygy_config = syzygy_config
+
+        await self.engine.send_opponent_information(opponent=opponent)
+        self.ponder = self.engine_config.ponder
+        self.opponent = opponent
+        self.game = object()
+        self.own_time = float('inf')
+        self.ponder_fen = None
+        self.ponder_pv = []
+        self.total_time_saved = 0.0
+        self._stop_ponder_analysis()
+        self.ponder_board = None
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        self.ponder_time_saved = 0.0
+        self.searches = 0
+        self.engine.output_time = 0.0
+
     async def make_move(self,
                         board: chess.Board,
                         white_time: float,
                         black_time: float,
                         increment: float
                         ) -> tuple[chess.Move, chess.engine.InfoDict]:
+        self.own_time = white_time if board.turn else black_time
+        if self.cpu_budget:
+            self.cpu_budget.rebalance()
+
+        if self.threads and self.threads != self.configured_threads and 'Threads' in self.engine.options:
+            await self.engine.configure({'Threads': self.threads})
+            self.configured_threads = self.threads
+
         if len(board.move_stack) < 2:
-            limit = chess.engine.Limit(time=15.0) if self.opponent.is_engine else chess.engine.Limit(time=5.0)
+            move_time = 15.0 if self.opponent.is_engine else 5.0
+            limit = chess.engine.Limit(time=move_time)
             ponder = False
         else:
+            move_time = self._get_nominal_time(increment) * MAX_MOVE_TIME_FACTOR
             limit = chess.engine.Limit(white_clock=white_time, white_inc=increment,
                                        black_clock=black_time, black_inc=increment)
             ponder = self.ponder
 
-        result = await self.engine.play(board, limit, info=chess.engine.INFO_ALL, ponder=ponder)
+        stop_deadline = min(move_time + 1.0, self.own_time * 0.8)
+        emergency_deadline = min(stop_deadline + 1.0, self.own_time * 0.9)
+
+        self.search_info = {}
+        self.time_saved = 0.0
+        self.is_ponder_move = False
+        if ponder_hit := self._get_ponder_hit(board):
+            self.time_saved = self._get_nominal_time(increment)
+            self.is_ponder_move = True
+            await self._start_pondering_after(board, ponder_hit[0])
+            return ponder_hit
 
-        if not result.move:
+        if self.engine_config.stable_depths and len(board.move_stack) >= 2:
+            search = self._analyse_until_stable(board, limit, increment)
+        else:
+            search = self._play(board, limit)
+
+        search_task = asyncio.create_task(search)
+        try:
+            done, _ = await asyncio.wait({search_task}, timeout=stop_deadline)
+            if not done:
+                print('Engine exceeded its time. Sending stop ...')
+                self.engine.send_line('stop')
+                done, _ = await asyncio.wait({search_task}, timeout=emergency_deadline - stop_deadline)
+        except asyncio.CancelledError:
+            search_task.cancel()
+            raise
+
+        if not done:
+            self.transport.kill()
+            try:
+                await asyncio.wait_for(search_task, timeout=1.0)
+            except (chess.engine.EngineError, TimeoutError):
+                pass
+
+            return self._get_emergency_move(board), self.search_info
+
+        self.searches += 1
+        move, info = search_task.result()
+        if not move:
             raise RuntimeError('Engine could not make a move!')
 
-        return result.move, result.info
+        self._set_ponder_pv(board, info.get('pv', []))
+        if ponder:
+            await self._start_pondering_after(board, move)
+
+        return move, info
+
+    def record_move(self) -> None:
+        self.total_time_saved += self.time_saved
+        if self.is_ponder_move:
+            self.ponder_time_saved += self.time_saved
+
+        if self.ponder_result == 'hit':
+            self.ponder_hits += 1
+        elif self.ponder_result == 'miss':
+            self.ponder_misses += 1
+
+    def _get_ponder_hit(self, board: chess.Board) -> tuple[chess.Move, chess.engine.InfoDict] | None:
+        ponder_info = self.ponder_info
+        ponder_board = self.ponder_board
+        self._stop_ponder_analysis()
+        self.ponder_board = None
+        self.ponder_result = None
+
+        if not ponder_board:
+            return
+
+        pv = ponder_info.get('pv', [])
+        if not pv or not board.move_stack or board.peek() != pv[0]:
+            self.ponder_result = 'miss'
+            return
+
+        ponder_board.push(pv[0])
+        if ponder_board != board:
+            self.ponder_result = 'miss'
+            return
+
+        self.ponder_result = 'hit'
+        if self.engine_config.ponder_hit_depth is None or len(pv) < 2 or 'score' not in ponder_info:
+            return
+
+        depth = ponder_info.get('depth', 0) - 1
+        if depth < self.engine_config.ponder_hit_depth:
+            return
+
+        info: chess.engine.InfoDict = {'depth': depth,
+                                       'pv': pv[1:],
+                                       'score': chess.engine.PovScore(ponder_info['score'].pov(board.turn),
+                                                                      board.turn)}
+
+        if 'seldepth' in ponder_info:
+            info['seldepth'] = ponder_info['seldepth']
+
+        if 'nodes' in ponder_info:
+            info['nodes'] = ponder_info['nodes']
+
+        if 'nps' in ponder_info:
+            info['nps'] = ponder_info['nps']
+
+        if 'hashfull' in ponder_info:
+            info['hashfull'] = ponder_info['hashfull']
+
+        if 'tbhits' in ponder_info:
+            info['tbhits'] = ponder_info['tbhits']
+
+        return pv[1], info
+
+    def _get_nominal_time(self, increment: float) -> float:
+        return self.own_time / 40 + increment
+
+    async def _start_pondering_after(self, board: chess.Board, move: chess.Move) -> None:
+        ponder_board = board.copy()
+        ponder_board.push(move)
+        await self.start_pondering(ponder_board)
+
+    async def _play(self,
+                    board: chess.Board,
+                    limit: chess.engine.Limit
+                    ) -> tuple[chess.Move | None, chess.engine.InfoDict]:
+        analysis = await self.engine.analysis(board, limit, game=self.game, info=self.info_selector,
+                                              options=self._get_play_options())
+        try:
+            async for info in analysis:
+                if 'pv' in info:
+                    self.search_info = info
+        except asyncio.CancelledError:
+            analysis.stop()
+            raise
+
+        best_move = await analysis.wait()
+        info = analysis.info
+        if 'pv' not in info and best_move.move:
+            info['pv'] = [best_move.move, best_move.ponder] if best_move.ponder else [best_move.move]
+
+        return best_move.move, info
+
+    async def _analyse_until_stable(self,
+                                    board: chess.Board,
+                                    limit: chess.engine.Limit,
+                                    increment: float
+                                    ) -> tuple[chess.Move | None, chess.engine.InfoDict]:
+        assert self.engine_config.stable_depths
+        score_window = 20 if self.engine_config.stable_score_window is None else self.engine_config.stable_score_window
+        stable_move: chess.Move | None = None
+        stable_score = 0
+        stable_depths = 0
+        last_depth = 0
+
+        start_time = time.perf_counter()
+        analysis = await self.engine.analysis(board, limit, game=self.game,
+                                              info=self.info_selector | chess.engine.INFO_SCORE | chess.engine.INFO_PV,
+                                              options=self._get_play_options())
+        try:
+            async for info in analysis:
+                depth = info.get('depth')
+                if 'pv' not in info or 'score' not in info or depth is None or depth <= last_depth:
+                    continue
+
+                last_depth = depth
+                self.search_info = info
+                score = info['score'].relative.score(mate_score=40_000)
+                if info['pv'][0] == stable_move and abs(score - stable_score) <= score_window:
+                    stable_depths += 1
+                else:
+                    stable_move = info['pv'][0]
+                    stable_score = score
+                    stable_depths = 0
+
+                if stable_depths >= self.engine_config.stable_depths and last_depth >= MIN_EARLY_STOP_DEPTH:
+                    analysis.stop()
+                    self.time_saved = max(self._get_nominal_time(increment) - (time.perf_counter() - start_time), 0.0)
+                    break
+        except asyncio.CancelledError:
+            analysis.stop()
+            raise
+
+        best_move = await analysis.wait()
+        return best_move.move, analysis.info
+
+    async def rank_root_moves(self, board: chess.Board, moves: list[chess.Move]) -> list[chess.engine.InfoDict]:
+        return await self.engine.analyse(board, chess.engine.Limit(depth=1), multipv=len(moves), game=self.game,
+                                         info=chess.engine.INFO_SCORE | chess.engine.INFO_PV, root_moves=moves)
+
+    def _get_play_options(self) -> dict[str, bool]:
+        if 'UCI_AnalyseMode' not in self.engine.options:
+            return {}
+
+        return {'UCI_AnalyseMode': False}
+
+    def _set_ponder_pv(self, board: chess.Board, pv: list[chess.Move]) -> None:
+        self.ponder_fen = None
+        self.ponder_pv = []
+        if len(pv) < 3:
+            return
+
+        board = board.copy(stack=False)
+        board.push(pv[0])
+        board.push(pv[1])
+        self.ponder_fen = board.fen()
+        self.ponder_pv = pv[2:]
+
+    async def _consume_ponder_analysis(self, analysis: chess.engine.AnalysisResult) -> None:
+        try:
+            async for info in analysis:
+                if 'pv' in info:
+                    self.ponder_info = info
+        except chess.engine.EngineError:
+            pass
+
+    def _stop_ponder_analysis(self) -> None:
+        if self.ponder_analysis:
+            self.ponder_analysis.stop()
+            self.ponder_analysis = None
+
+        if self.ponder_task:
+            self.ponder_task.cancel()
+            self.ponder_task = None
+
+        self.ponder_info = {}
+
+    @property
+    def average_output_time(self) -> float:
+        return self.engine.output_time / self.searches if self.searches else 0.0
+
+    @property
+    def ponder_hit_rate(self) -> float:
+        ponder_count = self.ponder_hits + self.ponder_misses
+        return self.ponder_hits / ponder_count if ponder_count else 0.0
+
+    def _get_emergency_move(self, board: chess.Board) -> chess.Move:
+        if 'pv' in self.search_info and self.search_info['pv'][0] in board.legal_moves:
+            print('Engine did not respond in time. Playing best move of the interrupted search.')
+            return self.search_info['pv'][0]
+
+        if board.fen() == self.ponder_fen and self.ponder_pv[0] in board.legal_moves:
+            print('Engine did not respond in time. Playing move from the last PV.')
+            return self.ponder_pv[0]
+
+        print('Engine did not respond in time. Playing emergency move.')
+        legal_moves = list(board.legal_moves)
+        for move in legal_moves:
+            if board.is_capture(move) or board.gives_check(move):
+                board.push(move)
+                is_checkmate = board.is_checkmate()
+                board.pop()
+
+                if is_checkmate:
+                    return move
+
+        captures = [move for move in legal_moves if board.is_capture(move)]
+        if captures:
+            return max(captures, key=lambda move: board.piece_type_at(move.to_square) or chess.PAWN)
+
+        return random.choice(legal_moves)
 
     async def start_pondering(self, board: chess.Board) -> None:
         if self.ponder:
-            await self.engine.analysis(board)
+            self._stop_ponder_analysis()
+            try:
+                self.ponder_analysis = await self.engine.analysis(
+                    board, game=self.game, info=chess.engine.INFO_SCORE | chess.engine.INFO_PV)
+            except chess.engine.EngineTerminatedError:
+                print('Engine terminated while starting to ponder.')
+                return
+
+            self.ponder_info = {}
+            self.ponder_board = board.copy()
+            self.ponder_task = asyncio.create_task(self._consume_ponder_analysis(self.ponder_analysis))
+
+    def cancel_pondering(self) -> None:
+        self._stop_ponder_analysis()
+        self.ponder_board = None
 
     async def stop_pondering(self, board: chess.Board) -> None:
         if self.ponder:
             self.ponder = False
-            await self.engine.analysis(board, chess.engine.Limit(time=0.001))
+            self._stop_ponder_analysis()
+            self.ponder_board = None
+            try:
+                await self.engine.analysis(board, chess.engine.Limit(time=0.001), game=self.game)
+            except chess.engine.EngineTerminatedError:
+                print('Engine terminated while stopping to ponder.')
 
     async def close(self) -> None:
         try:
             await asyncio.wait_for(self.engine.quit(), 5.0)
         except TimeoutError:
             print('Engine could not be terminated cleanly.')
+        except chess.engine.EngineTerminatedError:
+            pass
 
         self.transport.close()
+
+
+class CPU_Budget:
+    def __init__(self) -> None:
+        self.max_threads = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+        self.engines: list[Engine] = []
+
+    def add_engine(self, engine: Engine) -> None:
+        self.engines.append(engine)
+        engine.cpu_budget = self
+        self.rebalance()
+
+    def remove_engine(self, engine: Engine) -> None:
+        if engine in self.engines:
+            self.engines.remove(engine)
+            engine.cpu_budget = None
+            self.rebalance()
+
+    def rebalance(self) -> None:
+        spare_threads = self.max_threads - len(self.engines)
+        for engine in sorted(self.engines, key=self._get_priority):
+            extra_threads = max(min(engine.requested_threads - 1, spare_threads), 0)
+            engine.threads = 1 + extra_threads
+            spare_threads -= extra_threads
+
+    @staticmethod
+    def _get_priority(engine: Engine) -> float:
+        if engine.threads and engine.threads > 1:
+            return engine.own_time * THREAD_HYSTERESIS
+
+        return engine.own_time
+
+    def __str__(self) -> str:
+        assigned_threads = sum(engine.threads or 0 for engine in self.engines)
+        requested_threads = sum(engine.requested_threads for engine in self.engines)
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'CPU budget: {assigned_threads}/{self.max_threads} threads',
+                               f'Requested: {requested_threads}',
+                               f'Engines: {len(self.engines)}'))
+
+
+class Memory_Budget:
+    def __init__(self, max_memory: int | None) -> None:
+        total_memory = psutil.virtual_memory().total // 1_048_576
+        self.max_memory = total_memory * 3 // 4 if max_memory is None else max_memory
+        self.reserved_memory = total_memory // 10
+        self.pending_memory = 0
+        self.engines: list[Engine] = []
+
+    def add_engine(self, engine: Engine) -> None:
+        self.engines.append(engine)
+
+    def remove_engine(self, engine: Engine) -> None:
+        if engine in self.engines:
+            self.engines.remove(engine)
+
+    @property
+    def used_memory(self) -> int:
+        return sum(engine.hash_size for engine in self.engines) + self.pending_memory
+
+    @property
+    def free_memory(self) -> int:
+        available_memory = psutil.virtual_memory().available // 1_048_576 - self.reserved_memory
+        return max(min(self.max_memory - self.used_memory, available_memory), 0)
+
+    def has_capacity(self, game_count: int, hash_size: int, reclaimable_memory: int = 0) -> bool:
+        return self.free_memory + reclaimable_memory >= game_count * hash_size
+
+    def reserve(self, requested_hash_size: int) -> int:
+        hash_size = max(min(requested_hash_size, self.free_memory), MIN_HASH_SIZE)
+        self.pending_memory += hash_size
+        return hash_size
+
+    def unreserve(self, hash_size: int) -> None:
+        self.pending_memory -= hash_size
+
+    def __str__(self) -> str:
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Memory budget: {self.used_memory}/{self.max_memory} MB Hash',
+                               f'Free: {self.free_memory} MB',
+                               f'Engines: {len(self.engines)}'))
+
+
+class Engine_Pool:
+    def __init__(self,
+                 engine_configs: dict[str, Engine_Config],
+                 cpu_budget: CPU_Budget,
+                 memory_budget: Memory_Budget) -> None:
+        self.engine_configs = engine_configs
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.idle_engines: defaultdict[str, deque[tuple[Engine, float]]] = defaultdict(deque)
+        self.eviction_task: asyncio.Task[None] | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.wait_time = 0.0
+        self.restarts = 0
+        self.restart_time = 0.0
+
+    async def start(self) -> None:
+        for engine_key, engine_config in self.engine_configs.items():
+            for _ in range(len(self.idle_engines[engine_key]), engine_config.pool_size or 0):
+                requested_hash_size = Engine.get_requested_hash_size(engine_config)
+                if requested_hash_size and self.memory_budget.free_memory < requested_hash_size:
+                    print(f'Not enough memory to keep a "{engine_key}" engine warm.')
+                    break
+
+                engine = await self._spawn(engine_config,
+                                           Syzygy_Config(False, [], 0, False),
+                                           chess.engine.Opponent(None, None, None, False))
+                self.idle_engines[engine_key].append((engine, time.monotonic()))
+
+        self.eviction_task = asyncio.create_task(self._eviction_task())
+
+    async def acquire(self,
+                      engine_key: str,
+                      syzygy_config: Syzygy_Config,
+                      opponent: chess.engine.Opponent) -> Engine:
+        start_time = time.perf_counter()
+        idle_engines = self.idle_engines[engine_key]
+
+        while idle_engines:
+            engine, _ = idle_engines.pop()
+            if not engine.is_alive:
+                await self._close(engine)
+                continue
+
+            try:
+                await asyncio.wait_for(engine.new_game(syzygy_config, opponent), 5.0)
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+                await self._close(engine)
+                continue
+
+            self.hits += 1
+            self.wait_time += time.perf_counter() - start_time
+            self.cpu_budget.add_engine(engine)
+            return engine
+
+        engine_config = self.engine_configs[engine_key]
+        hash_size = 0
+        if requested_hash_size := Engine.get_requested_hash_size(engine_config):
+            await self._free_memory(requested_hash_size)
+
+            hash_size = self.memory_budget.reserve(requested_hash_size)
+            if hash_size < requested_hash_size:
+                print(f'Hash reduced from {requested_hash_size} MB to {hash_size} MB due to the memory budget.')
+                engine_config = replace(engine_config, uci_options=engine_config.uci_options | {'Hash': hash_size})
+
+        try:
+            engine = await self._spawn(engine_config, syzygy_config, opponent)
+        finally:
+            self.memory_budget.unreserve(hash_size)
+
+        self.misses += 1
+        self.wait_time += time.perf_counter() - start_time
+        self.cpu_budget.add_engine(engine)
+        return engine
+
+    async def release(self, engine_key: str, engine: Engine) -> None:
+        self.cpu_budget.remove_engine(engine)
+        idle_engines = self.idle_engines[engine_key]
+        if not engine.is_alive or len(idle_engines) >= (self.engine_configs[engine_key].pool_size or 0):
+            await self._close(engine)
+            return
+
+        try:
+            await asyncio.wait_for(engine.engine.ping(), 5.0)
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+            await self._close(engine)
+            return
+
+        idle_engines.append((engine, time.monotonic()))
+
+    async def restart(self, engine_key: str, engine: Engine) -> Engine:
+        start_time = time.perf_counter()
+        self.cpu_budget.remove_engine(engine)
+        await self._close(engine)
+
+        new_engine = await self.acquire(engine_key, engine.syzygy_config, engine.opponent)
+        new_engine.ponder = engine.ponder
+        self.restarts += 1
+        self.restart_time += time.perf_counter() - start_time
+        return new_engine
+
+    async def close(self) -> None:
+        if self.eviction_task:
+            self.eviction_task.cancel()
+
+        for idle_engines in self.idle_engines.values():
+            while idle_engines:
+                engine, _ = idle_engines.pop()
+                await self._close(engine)
+
+    def has_memory_for(self, game_count: int) -> bool:
+        expected_hash_size = max(map(Engine.get_requested_hash_size, self.engine_configs.values()), default=0)
+        idle_memory = sum(engine.hash_size for idle_engines in self.idle_engines.values() for engine, _ in idle_engines)
+        return self.memory_budget.has_capacity(game_count, max(expected_hash_size, MIN_HASH_SIZE), idle_memory)
+
+    @property
+    def hit_rate(self) -> float:
+        checkouts = self.hits + self.misses
+        return self.hits / checkouts if checkouts else 0.0
+
+    @property
+    def average_wait_time(self) -> float:
+        checkouts = self.hits + self.misses
+        return self.wait_time / checkouts if checkouts else 0.0
+
+    @property
+    def average_restart_time(self) -> float:
+        return self.restart_time / self.restarts if self.restarts else 0.0
+
+    def __str__(self) -> str:
+        idle_count = sum(len(idle_engines) for idle_engines in self.idle_engines.values())
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Engine pool: {idle_count} idle',
+                               f'Hit rate: {self.hit_rate * 100:5.1f} %',
+                               f'Avg wait: {self.average_wait_time * 1000:.0f} ms',
+                               f'Evictions: {self.evictions}',
+                               f'Restarts: {self.restarts}',
+                               f'Avg restart: {self.average_restart_time * 1000:.0f} ms'))
+
+    async def _spawn(self,
+                     engine_config: Engine_Config,
+                     syzygy_config: Syzygy_Config,
+                     opponent: chess.engine.Opponent) -> Engine:
+        engine = await Engine.from_config(engine_config, syzygy_config, opponent)
+        self.memory_budget.add_engine(engine)
+        return engine
+
+    async def _close(self, engine: Engine) -> None:
+        self.memory_budget.remove_engine(engine)
+        await engine.close()
+
+    async def _free_memory(self, hash_size: int) -> None:
+        idle_engines = sorted(((last_used, engine_key)
+                               for engine_key, idle_engines in self.idle_engines.items()
+                               for _, last_used in idle_engines))
+
+        for _, engine_key in idle_engines:
+            if self.memory_budget.free_memory >= hash_size:
+                return
+
+            if not self.idle_engines[engine_key]:
+                continue
+
+            engine, _ = self.idle_engines[engine_key].popleft()
+            await self._close(engine)
+            self.evictions += 1
+
+    async def _eviction_task(self) -> None:
+        while True:
+            await asyncio.sleep(60.0)
+
+            for engine_key, idle_engines in self.idle_engines.items():
+                timeout = self.engine_configs[engine_key].pool_timeout
+                if timeout is None:
+                    continue
+
+                while idle_engines and time.monotonic() - idle_engines[0][1] >= timeout:
+                    engine, _ = idle_engines.popleft()
+                    await self._close(engine)
+                    self.evictions += 1
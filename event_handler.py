@@ -5,6 +5,7 @@ from api import API
 from botli_dataclasses import Challenge
 from challenge_validator import Challenge_Validator
 from config import Config
+from enums import Variant
 from game_manager import Game_Manager
 
 
@@ -34,7 +35,10 @@ class Event_Handler:
                         continue
 
                     self.game_manager.add_challenge(Challenge(event['challenge']['id'],
-                                                              event['challenge']['challenger']['name']))
+                                                              event['challenge']['challenger']['name'],
+                                                              self._get_own_color(event['challenge']),
+                                                              Variant(event['challenge']['variant']['key']),
+                                                              event['challenge']['speed']))
                     print('Challenge added to queue.')
                     print(128 * '‾')
                 case 'gameStart':
@@ -60,6 +64,14 @@ class Event_Handler:
                 case _:
                     print(event)
 
+    @staticmethod
+    def _get_own_color(challenge_event: dict[str, Any]) -> str | None:
+        match challenge_event['color']:
+            case 'white':
+                return 'black'
+            case 'black':
+                return 'white'
+
     def _print_challenge_event(self, challenge_event: dict[str, Any]) -> None:
         id_str = f'ID: {challenge_event["id"]}'
         title = challenge_event['challenger'].get('title') or ''
@@ -2,18 +2,34 @@ import asyncio
 from typing import Any
 
 from api import API
+from book_registry import Book_Registry
 from botli_dataclasses import Game_Information
 from chatter import Chatter
 from config import Config
+from engine import Engine_Pool
 from lichess_game import Lichess_Game
+from repertoire_prefetcher import Repertoire_Prefetcher
+from tablebase_manager import Tablebase_Manager
 
 
 class Game:
-    def __init__(self, api: API, config: Config, username: str, game_id: str) -> None:
+    def __init__(self,
+                 api: API,
+                 config: Config,
+                 username: str,
+                 game_id: str,
+                 engine_pool: Engine_Pool,
+                 book_registry: Book_Registry,
+                 tablebase_manager: Tablebase_Manager,
+                 repertoire_prefetcher: Repertoire_Prefetcher) -> None:
         self.api = api
         self.config = config
         self.username = username
         self.game_id = game_id
+        self.engine_pool = engine_pool
+        self.book_registry = book_registry
+        self.tablebase_manager = tablebase_manager
+        self.repertoire_prefetcher = repertoire_prefetcher
         self.was_aborted = False
         self.move_task: asyncio.Task[None] | None = None
 
@@ -21,7 +37,9 @@ class Game:
         game_stream_queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
         asyncio.create_task(self.api.get_game_stream(self.game_id, game_stream_queue))
         info = Game_Information.from_gameFull_event(await game_stream_queue.get())
-        lichess_game = await Lichess_Game.acreate(self.api, self.config, self.username, info)
+        lichess_game = await Lichess_Game.acreate(self.api, self.config, self.username, info,
+                                                  self.engine_pool, self.book_registry, self.tablebase_manager,
+                                                  self.repertoire_prefetcher)
         chatter = Chatter(self.api, self.config, self.username, info, lichess_game)
 
         self._print_game_information(info)
@@ -32,6 +50,7 @@ class Game:
             await lichess_game.close()
             return
 
+        lichess_game.start_repertoire_prefetch()
         await chatter.send_greetings()
 
         if lichess_game.is_our_turn:
@@ -59,6 +78,7 @@ class Game:
                 if self.move_task:
                     self.move_task.cancel()
 
+                self._print_engine_statistics(lichess_game)
                 self._print_result_message(event, lichess_game, info)
                 await chatter.send_goodbyes()
                 break
@@ -94,6 +114,25 @@ class Game:
 
         print(f'\n{message}\n{128 * "‾"}')
 
+    def _print_engine_statistics(self, lichess_game: Lichess_Game) -> None:
+        engine = lichess_game.engine
+        if engine.searches:
+            print(f'Searches: {engine.searches}     '
+                  f'Engine output parsing: {engine.average_output_time * 1000:.1f} ms/move '
+                  f'(info level: {engine.engine_config.info_level or "all"})')
+
+        reply_prefetcher = lichess_game.reply_prefetcher
+        if reply_prefetcher.predictions:
+            print(f'Prefetch hits: {reply_prefetcher.hits}/{reply_prefetcher.predictions} '
+                  f'({reply_prefetcher.hit_rate * 100:.1f} %)')
+
+        ponder_count = engine.ponder_hits + engine.ponder_misses
+        if not ponder_count:
+            return
+
+        print(f'Ponder hits: {engine.ponder_hits}/{ponder_count} ({engine.ponder_hit_rate * 100:.1f} %)     '
+              f'Saved: {engine.ponder_time_saved:.1f} s')
+
     def _print_result_message(self,
                               game_state: dict[str, Any],
                               lichess_game: Lichess_Game,
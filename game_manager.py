@@ -3,12 +3,19 @@ from asyncio import Event, Task
 from collections import deque
 from typing import Any
 
+import chess
+
 from api import API
+from book_registry import Book_Registry
 from botli_dataclasses import Challenge, Challenge_Request, Tournament, Tournament_Request
 from challenger import Challenger
 from config import Config
+from engine import CPU_Budget, Engine_Pool, Memory_Budget
+from enums import Variant
 from game import Game
 from matchmaking import Matchmaking
+from repertoire_prefetcher import Repertoire_Prefetcher
+from tablebase_manager import Tablebase_Manager
 
 
 class Game_Manager:
@@ -19,6 +26,15 @@ class Game_Manager:
 
         self.challenger = Challenger(api)
         self.changed_event = Event()
+        self.cpu_budget = CPU_Budget()
+        self.memory_budget = Memory_Budget(config.resources.max_memory)
+        self.engine_pool = Engine_Pool(config.engines, self.cpu_budget, self.memory_budget)
+        self.book_registry = Book_Registry(config.resources.max_ram_book_size)
+        self.tablebase_manager = Tablebase_Manager(config.syzygy,
+                                                   config.gaviota,
+                                                   config.resources.preload_tablebase_pieces,
+                                                   config.resources.lock_tablebases)
+        self.repertoire_prefetcher = Repertoire_Prefetcher(api, config.online_moves.opening_explorer)
         self.matchmaking = Matchmaking(api, config, username)
 
         self.challenge_requests: deque[Challenge_Request] = deque()
@@ -42,6 +58,10 @@ class Game_Manager:
         self.changed_event.set()
 
     async def run(self) -> None:
+        await self.engine_pool.start()
+        await self.tablebase_manager.start()
+        await self.book_registry.start(self.config.opening_books)
+
         while self.is_running:
             try:
                 async with asyncio.timeout_at(self.next_matchmaking):
@@ -80,6 +100,11 @@ class Game_Manager:
         for task in list(self.tasks):
             await task
 
+        await self.engine_pool.close()
+        self.book_registry.close()
+        self.tablebase_manager.close()
+        self.repertoire_prefetcher.close()
+
     @property
     def is_busy(self) -> bool:
         return (len(self.tasks) +
@@ -224,7 +249,8 @@ class Game_Manager:
             self.tournaments[tournament.id_] = tournament
             print(f'External joined tournament "{tournament.name}" detected.')
 
-        game = Game(self.api, self.config, self.username, game_event['id'])
+        game = Game(self.api, self.config, self.username, game_event['id'], self.engine_pool,
+                    self.book_registry, self.tablebase_manager, self.repertoire_prefetcher)
         task = asyncio.create_task(game.run())
         task.add_done_callback(self._task_callback)
         self.tasks[task] = game
@@ -236,14 +262,34 @@ class Game_Manager:
         if self.is_busy:
             return
 
+        if not self.engine_pool.has_memory_for(self.reserved_game_spots + 1):
+            print('Not enough memory for another engine. Postponing challenge acceptance ...')
+            return
+
         return self.open_challenges.popleft()
 
     async def _accept_challenge(self, challenge: Challenge) -> None:
         if await self.api.accept_challenge(challenge.challenge_id):
             self.reserved_game_spots += 1
+            self._prefetch_repertoire(challenge)
         else:
             print(f'Challenge "{challenge.challenge_id}" could not be accepted!')
 
+    def _prefetch_repertoire(self, challenge: Challenge) -> None:
+        opening_explorer_config = self.config.online_moves.opening_explorer
+        if not opening_explorer_config.enabled or challenge.variant != Variant.STANDARD or not challenge.speed:
+            return
+
+        colors = [challenge.color] if challenge.color else ['white', 'black']
+        for color in colors:
+            if opening_explorer_config.anti:
+                self.repertoire_prefetcher.start_prefetch(challenge.opponent_username,
+                                                          'black' if color == 'white' else 'white',
+                                                          challenge.variant, challenge.speed, chess.Board())
+            else:
+                self.repertoire_prefetcher.start_prefetch(self.username, color, challenge.variant, challenge.speed,
+                                                          chess.Board())
+
     async def _check_matchmaking(self) -> None:
         self.next_matchmaking = None
         self.is_rate_limited = False
@@ -1,23 +1,31 @@
+import asyncio
 import random
 import time
+from collections import Counter
 from collections.abc import Awaitable, Callable, Iterable
+from functools import partial
 from itertools import islice
-from typing import Any, Literal
+from typing import Any
 
 import chess
 import chess.engine
-import chess.gaviota
 import chess.polyglot
-import chess.syzygy
 from chess.variant import find_variant
 
-from api import API
-from botli_dataclasses import (Book_Settings, Game_Information, Gaviota_Result, Lichess_Move, Move_Response,
-                               Syzygy_Result)
+from api import API, SourceUnavailableException
+from book_registry import Book_Registry
+from botli_dataclasses import Book_Settings, Game_Information, Lichess_Move, Move_Response, Online_Result
 from config import Config
 from configs import Engine_Config, Syzygy_Config
-from engine import Engine
+from engine import Engine, Engine_Pool
 from enums import Variant
+from online_sources import Online_Request, Reply_Prefetcher, race_online_sources
+from repertoire_prefetcher import Repertoire_Prefetcher
+from tablebase_manager import Tablebase_Manager
+from tablebase_prober import Tablebase_Prober
+
+ONLINE_BUDGET_DIVISOR = 20
+ZOBRIST_INCOMPLETE_VARIANTS = {'crazyhouse', '3check'}
 
 
 class Lichess_Game:
@@ -27,22 +35,30 @@ class Lichess_Game:
                  username: str,
                  game_info: Game_Information,
                  board: chess.Board,
-                 syzygy_config: Syzygy_Config,
-                 engine_key: str,
-                 engine: Engine) -> None:
+                 engine_pool: Engine_Pool,
+                 engine: Engine,
+                 book_registry: Book_Registry,
+                 tablebase_manager: Tablebase_Manager,
+                 repertoire_prefetcher: Repertoire_Prefetcher) -> None:
         self.api = api
         self.config = config
+        self.engine_pool = engine_pool
+        self.book_registry = book_registry
+        self.repertoire_prefetcher = repertoire_prefetcher
         self.game_info = game_info
         self.board = board
-        self.syzygy_config = syzygy_config
+        self.position_counts = self._get_position_counts(board)
         self.white_time: float = self.game_info.state['wtime'] / 1000
         self.black_time: float = self.game_info.state['btime'] / 1000
         self.increment = self.game_info.increment_ms / 1000
         self.is_white = self.game_info.white_name == username
+        self.engine_key = self._get_engine_key(config, board, self.is_white, game_info)
+        self.syzygy_config = self._get_syzygy_config(config, board)
         self.book_settings = self._get_book_settings()
-        self.syzygy_tablebase = self._get_syzygy_tablebase()
-        self.gaviota_tablebase = self._get_gaviota_tablebase()
+        self.tablebase_prober = Tablebase_Prober(tablebase_manager, self.syzygy_config, config.gaviota, type(board))
+        self.online_sources = self._get_online_sources()
         self.move_sources = self._get_move_sources()
+        self.reply_prefetcher = Reply_Prefetcher(api, self._get_online_requests())
 
         self.opening_explorer_counter = 0
         self.out_of_opening_explorer_counter = 0
@@ -50,22 +66,32 @@ class Lichess_Game:
         self.out_of_cloud_counter = 0
         self.chessdb_counter = 0
         self.out_of_chessdb_counter = 0
-        self.move_overhead = self._get_move_overhead(config.engines[engine_key])
+        self.move_overhead = self._get_move_overhead(config.engines[self.engine_key])
         self.engine = engine
+        self.engine_task: asyncio.Task[tuple[chess.Move, chess.engine.InfoDict]] | None = None
         self.scores: list[chess.engine.PovScore] = []
         self.last_message = 'No eval available yet.'
         self.last_pv: list[chess.Move] = []
 
     @classmethod
-    async def acreate(cls, api: API, config: Config, username: str, game_info: Game_Information) -> 'Lichess_Game':
+    async def acreate(cls,
+                      api: API,
+                      config: Config,
+                      username: str,
+                      game_info: Game_Information,
+                      engine_pool: Engine_Pool,
+                      book_registry: Book_Registry,
+                      tablebase_manager: Tablebase_Manager,
+                      repertoire_prefetcher: Repertoire_Prefetcher) -> 'Lichess_Game':
         board = cls._get_board(game_info)
         is_white = game_info.white_name == username
         engine_key = cls._get_engine_key(config, board, is_white, game_info)
         syzygy_config = cls._get_syzygy_config(config, board)
-        engine = await Engine.from_config(config.engines[engine_key],
-                                          syzygy_config,
-                                          game_info.black_opponent if is_white else game_info.white_opponent)
-        return cls(api, config, username, game_info, board, syzygy_config, engine_key, engine)
+        engine = await engine_pool.acquire(engine_key,
+                                           syzygy_config,
+                                           game_info.black_opponent if is_white else game_info.white_opponent)
+        return cls(api, config, username, game_info, board, engine_pool, engine,
+                   book_registry, tablebase_manager, repertoire_prefetcher)
 
     @staticmethod
     def _get_board(game_info: Game_Information) -> chess.Board:
@@ -136,35 +162,83 @@ class Lichess_Game:
                 return Syzygy_Config(False, [], 0, False)
 
     async def make_move(self) -> Lichess_Move:
-        for move_source in self.move_sources:
-            if move_response := await move_source():
-                break
-        else:
-            move, info = await self.engine.make_move(self.board, *self.engine_times)
-
-            if 'score' in info:
-                self.scores.append(info['score'])
-            message = f'Engine:  {self._format_move(move):14} {self._format_engine_info(info)}'
-            move_response = Move_Response(move, message,
-                                          pv=info.get('pv', []),
-                                          is_engine_move=len(self.board.move_stack) > 1)
-
-        self.board.push(move_response.move)
+        try:
+            for move_source in self.move_sources:
+                if move_response := await move_source():
+                    break
+            else:
+                move, info = await self._get_engine_move()
+                self.engine.record_move()
+
+                if 'score' in info:
+                    self.scores.append(info['score'])
+                message = f'Engine:  {self._format_move(move):14} {self._format_engine_info(info)}'
+                if self.engine.time_saved:
+                    message += f'     Saved: {self.engine.time_saved:.1f} s / {self.engine.total_time_saved:.1f} s'
+                move_response = Move_Response(move, message,
+                                              pv=info.get('pv', []),
+                                              is_engine_move=len(self.board.move_stack) > 1)
+        finally:
+            await self._cancel_speculative_search()
+
+        self._push(move_response.move)
         if not move_response.is_engine_move:
             await self.engine.start_pondering(self.board)
 
+        if self.reply_prefetcher.is_active:
+            self.reply_prefetcher.start(self.board, [*move_response.pv[1:2], *self._get_book_replies()])
+
         print(f'{move_response.public_message} {move_response.private_message}'.strip())
         self.last_message = move_response.public_message
         self.last_pv = move_response.pv
 
         return Lichess_Move(move_response.move.uci(), self._offer_draw(move_response), self._resign(move_response))
 
+    async def _get_engine_move(self) -> tuple[chess.Move, chess.engine.InfoDict]:
+        if self.engine_task:
+            engine_task, self.engine_task = self.engine_task, None
+            return await engine_task
+
+        return await self._make_engine_move()
+
+    def _start_speculative_search(self) -> None:
+        if not self.engine_task:
+            self.engine_task = asyncio.create_task(self._make_engine_move())
+
+    async def _cancel_speculative_search(self) -> None:
+        if not self.engine_task:
+            return
+
+        engine_task, self.engine_task = self.engine_task, None
+        engine_task.cancel()
+        await asyncio.wait({engine_task})
+
+    async def _make_engine_move(self) -> tuple[chess.Move, chess.engine.InfoDict]:
+        if not self.engine.is_alive:
+            await self._restart_engine()
+
+        start_time = time.perf_counter()
+        try:
+            return await self.engine.make_move(self.board, *self.engine_times)
+        except chess.engine.EngineTerminatedError:
+            print('Engine terminated unexpectedly during search.')
+
+        await self._restart_engine()
+        self._reduce_own_time(time.perf_counter() - start_time)
+        return await self.engine.make_move(self.board, *self.engine_times)
+
+    async def _restart_engine(self) -> None:
+        print('Restarting engine ...')
+        self.engine = await self.engine_pool.restart(self.engine_key, self.engine)
+
     def update(self, gameState_event: dict[str, Any]) -> None:
         moves = gameState_event['moves'].split()
         if len(moves) <= len(self.board.move_stack):
             return
 
-        self.board.push(chess.Move.from_uci(moves[-1]))
+        move = chess.Move.from_uci(moves[-1])
+        self.reply_prefetcher.record_reply(move)
+        self._push(move)
         self.white_time = gameState_event['wtime'] / 1000
         self.black_time = gameState_event['btime'] / 1000
 
@@ -204,17 +278,20 @@ class Lichess_Game:
     async def start_pondering(self) -> None:
         await self.engine.start_pondering(self.board)
 
-    async def close(self) -> None:
-        await self.engine.close()
+    def start_repertoire_prefetch(self) -> None:
+        if self._make_opening_explorer_move not in self.online_sources:
+            return
 
-        for book_reader in self.book_settings.readers.values():
-            book_reader.close()
+        username, color, speeds = self._get_opening_explorer_query()
+        self.repertoire_prefetcher.start_prefetch(username, color, self.game_info.variant, speeds, self.board)
 
-        if self.syzygy_tablebase:
-            self.syzygy_tablebase.close()
+    async def close(self) -> None:
+        self.tablebase_prober.close()
+        self.reply_prefetcher.close()
+        await self.engine_pool.release(self.engine_key, self.engine)
 
-        if self.gaviota_tablebase:
-            self.gaviota_tablebase.close()
+        if self.book_settings.index:
+            self.book_registry.release(self.book_settings.index)
 
     def _offer_draw(self, move_response: Move_Response) -> bool:
         if not self.config.offer_draw.enabled:
@@ -264,33 +341,21 @@ class Lichess_Game:
         return True
 
     async def _make_book_move(self) -> Move_Response | None:
-        if self.book_settings.max_depth and self.board.ply() >= self.book_settings.max_depth:
+        if not self.book_settings.index:
             return
 
-        for name, book_reader in self.book_settings.readers.items():
-            entries = list(book_reader.find_all(self.board))
-            if not entries:
-                continue
-
-            match self.book_settings.selection:
-                case 'weighted_random':
-                    entries.sort(key=lambda entry: random.random() ** (1.0 / entry.weight), reverse=True)
-                case 'uniform_random':
-                    random.shuffle(entries)
-                case 'best_move':
-                    entries.sort(key=lambda entry: entry.weight, reverse=True)
+        if self.book_settings.max_depth and self.board.ply() >= self.book_settings.max_depth:
+            return
 
-            for entry in entries:
-                if not self._is_repetition(entry.move):
-                    break
-            else:
+        for book, book_position in self.book_registry.find_all(self.book_settings.index, self.board).items():
+            entry = book_position.select(self.book_settings.selection, self._is_repetition)
+            if not entry:
                 continue
 
-            weight = entry.weight / sum(entry.weight for entry in entries) * 100.0
             learn = entry.learn if self.config.opening_books.read_learn else 0
-            name = name if len(self.book_settings.readers) > 1 else ''
+            name = self.book_settings.names[book] if len(self.book_settings.names) > 1 else ''
             public_message = f'Book:    {self._format_move(entry.move):14}'
-            private_message = f'{self._format_book_info(weight, learn)}     {name}'
+            private_message = f'{self._format_book_info(entry.weight, learn)}     {name}'
             return Move_Response(entry.move, public_message, private_message=private_message)
 
     def _get_book_settings(self) -> Book_Settings:
@@ -304,8 +369,8 @@ class Lichess_Game:
         books_config = self.config.opening_books.books[key]
         return Book_Settings(books_config.selection,
                              books_config.max_depth,
-                             {name: chess.polyglot.open_reader(path)
-                              for name, path in books_config.names.items()})
+                             list(books_config.names),
+                             self.book_registry.acquire(list(books_config.names.values())))
 
     def _get_book_key(self) -> str | None:
         color = 'white' if self.is_white else 'black'
@@ -342,48 +407,22 @@ class Lichess_Game:
 
         return
 
-    async def _make_opening_explorer_move(self) -> Move_Response | None:
-        out_of_book = self.out_of_opening_explorer_counter >= 5
-        too_deep = (False
-                    if self.config.online_moves.opening_explorer.max_depth is None
-                    else self.board.ply() >= self.config.online_moves.opening_explorer.max_depth)
-        out_of_range = self.board.fullmove_number > 25
-        too_many_moves = (False
-                          if self.config.online_moves.opening_explorer.max_moves is None
-                          else self.opening_explorer_counter >= self.config.online_moves.opening_explorer.max_moves)
+    async def _make_opening_explorer_move(self) -> Online_Result | None:
         has_time = self._has_time(self.config.online_moves.opening_explorer.min_time)
-
-        if out_of_book or too_deep or out_of_range or too_many_moves or not has_time:
+        if not self._is_opening_explorer_eligible(self.board) or not has_time:
             return
 
-        if self.config.online_moves.opening_explorer.anti:
-            color = 'black' if self.board.turn else 'white'
-            username = self.game_info.black_name if self.board.turn else self.game_info.white_name
-        else:
-            color = 'white' if self.board.turn else 'black'
-            username = self.game_info.white_name if self.board.turn else self.game_info.black_name
-
-        if self.board.uci_variant != 'chess' or self.board.chess960:
-            speeds = 'bullet,blitz,rapid,classical'
-        else:
-            speeds = self.game_info.speed
+        try:
+            response = await self._request_opening_explorer(self.board, self._get_move_budget())
+        except SourceUnavailableException:
+            return
 
-        start_time = time.perf_counter()
-        response = await self.api.get_opening_explorer(username,
-                                                       self.board.fen(),
-                                                       self.game_info.variant,
-                                                       color,
-                                                       speeds,
-                                                       self.config.online_moves.opening_explorer.timeout)
         if response is None:
-            self.out_of_opening_explorer_counter += 1
-            self._reduce_own_time(time.perf_counter() - start_time)
-            return
+            return Online_Result('opening_explorer', is_out_of_book=True)
 
         game_count = response['white'] + response['draws'] + response['black']
         if game_count < max(self.config.online_moves.opening_explorer.min_games, 1):
-            self.out_of_opening_explorer_counter += 1
-            return
+            return Online_Result('opening_explorer', is_out_of_book=True)
 
         for move in response['moves']:
             move['wins'] = move['white'] if self.board.turn else move['black']
@@ -393,20 +432,58 @@ class Lichess_Game:
             response['moves'] = list(filter(lambda move: move['wins'] > 0, response['moves']))
 
             if not response['moves']:
-                self.out_of_opening_explorer_counter += 1
-                return
+                return Online_Result('opening_explorer', is_out_of_book=True)
 
-        self.out_of_opening_explorer_counter = 0
         top_move = self._get_opening_explorer_top_move(response['moves'])
         move = chess.Move.from_uci(top_move['uci'])
         if self._is_repetition(move):
-            return
+            return Online_Result('opening_explorer')
 
-        self.opening_explorer_counter += 1
         public_message = f'Explore: {self._format_move(move):14}'
         private_message = (f'Performance: {top_move["performance"]}      '
                            f'WDL: {top_move["wins"]}/{top_move["draws"]}/{top_move["losses"]}')
-        return Move_Response(move, public_message, private_message=private_message)
+        return Online_Result('opening_explorer',
+                             Move_Response(move, public_message, private_message=private_message))
+
+    def _is_opening_explorer_eligible(self, board: chess.Board) -> bool:
+        out_of_book = self.out_of_opening_explorer_counter >= 5
+        too_deep = (False
+                    if self.config.online_moves.opening_explorer.max_depth is None
+                    else board.ply() >= self.config.online_moves.opening_explorer.max_depth)
+        out_of_range = board.fullmove_number > 25
+        too_many_moves = (False
+                          if self.config.online_moves.opening_explorer.max_moves is None
+                          else self.opening_explorer_counter >= self.config.online_moves.opening_explorer.max_moves)
+
+        return not (out_of_book or too_deep or out_of_range or too_many_moves)
+
+    def _get_opening_explorer_query(self) -> tuple[str, str, str]:
+        if self.config.online_moves.opening_explorer.anti:
+            color = 'black' if self.is_white else 'white'
+            username = self.game_info.black_name if self.is_white else self.game_info.white_name
+        else:
+            color = 'white' if self.is_white else 'black'
+            username = self.game_info.white_name if self.is_white else self.game_info.black_name
+
+        if self.board.uci_variant != 'chess' or self.board.chess960:
+            speeds = 'bullet,blitz,rapid,classical'
+        else:
+            speeds = self.game_info.speed
+
+        return username, color, speeds
+
+    async def _request_opening_explorer(self, board: chess.Board, budget: float) -> dict[str, Any] | None:
+        username, color, speeds = self._get_opening_explorer_query()
+        if response := self.repertoire_prefetcher.get(username, color, self.game_info.variant, speeds, board):
+            return response
+
+        return await self.api.get_opening_explorer(username,
+                                                   board.fen(),
+                                                   self.game_info.variant,
+                                                   color,
+                                                   speeds,
+                                                   self.config.online_moves.opening_explorer.timeout,
+                                                   budget)
 
     def _get_opening_explorer_top_move(self, moves: list[dict[str, Any]]) -> dict[str, Any]:
         if self.config.online_moves.opening_explorer.selection == 'win_rate':
@@ -424,78 +501,72 @@ class Lichess_Game:
 
         return max(moves, key=lambda move: move['performance'])
 
-    async def _make_cloud_move(self) -> Move_Response | None:
-        out_of_book = self.out_of_cloud_counter >= 5
-        too_deep = (False
-                    if self.config.online_moves.lichess_cloud.max_depth is None
-                    else self.board.ply() >= self.config.online_moves.lichess_cloud.max_depth)
-        too_many_moves = (False
-                          if self.config.online_moves.lichess_cloud.max_moves is None
-                          else self.cloud_counter >= self.config.online_moves.lichess_cloud.max_moves)
+    async def _make_cloud_move(self) -> Online_Result | None:
         has_time = self._has_time(self.config.online_moves.lichess_cloud.min_time)
+        if not self._is_cloud_eligible(self.board) or not has_time:
+            return
 
-        if out_of_book or too_deep or too_many_moves or not has_time:
+        try:
+            response = await self._request_cloud_eval(self.board, self._get_move_budget())
+        except SourceUnavailableException:
             return
 
-        start_time = time.perf_counter()
-        response = await self.api.get_cloud_eval(self.board.fen().replace('[', '/').replace(']', ''),
-                                                 self.game_info.variant,
-                                                 self.config.online_moves.lichess_cloud.timeout)
         if response is None:
-            self.out_of_cloud_counter += 1
-            self._reduce_own_time(time.perf_counter() - start_time)
-            return
+            return Online_Result('lichess_cloud', is_out_of_book=True)
 
         if 'error' in response:
-            self.out_of_cloud_counter += 1
-            return
+            return Online_Result('lichess_cloud', is_out_of_book=True)
 
         if response['depth'] < self.config.online_moves.lichess_cloud.min_eval_depth:
-            self.out_of_cloud_counter += 1
-            return
+            return Online_Result('lichess_cloud', is_out_of_book=True)
 
-        self.out_of_cloud_counter = 0
         pv = [chess.Move.from_uci(uci_move) for uci_move in response['pvs'][0]['moves'].split()]
         if self._is_repetition(pv[0]):
-            return
+            return Online_Result('lichess_cloud')
 
         if 'mate' in response['pvs'][0]:
             score = chess.engine.Mate(response['pvs'][0]['mate'])
         else:
             score = chess.engine.Cp(response['pvs'][0]['cp'])
 
-        self.cloud_counter += 1
         message = (f'Cloud:   {self._format_move(pv[0]):14} '
                    f'{self._format_score(chess.engine.PovScore(score, chess.WHITE))}     '
                    f'Depth: {response["depth"]}')
-        return Move_Response(pv[0], message, pv=pv)
+        return Online_Result('lichess_cloud', Move_Response(pv[0], message, pv=pv))
 
-    async def _make_chessdb_move(self) -> Move_Response | None:
-        out_of_book = self.out_of_chessdb_counter >= 5
+    def _is_cloud_eligible(self, board: chess.Board) -> bool:
+        out_of_book = self.out_of_cloud_counter >= 5
         too_deep = (False
-                    if self.config.online_moves.chessdb.max_depth is None
-                    else self.board.ply() >= self.config.online_moves.chessdb.max_depth)
+                    if self.config.online_moves.lichess_cloud.max_depth is None
+                    else board.ply() >= self.config.online_moves.lichess_cloud.max_depth)
         too_many_moves = (False
-                          if self.config.online_moves.chessdb.max_moves is None
-                          else self.chessdb_counter >= self.config.online_moves.chessdb.max_moves)
+                          if self.config.online_moves.lichess_cloud.max_moves is None
+                          else self.cloud_counter >= self.config.online_moves.lichess_cloud.max_moves)
+
+        return not (out_of_book or too_deep or too_many_moves)
+
+    async def _request_cloud_eval(self, board: chess.Board, budget: float) -> dict[str, Any] | None:
+        return await self.api.get_cloud_eval(board.fen().replace('[', '/').replace(']', ''),
+                                             self.game_info.variant,
+                                             self.config.online_moves.lichess_cloud.timeout,
+                                             budget)
+
+    async def _make_chessdb_move(self) -> Online_Result | None:
         has_time = self._has_time(self.config.online_moves.chessdb.min_time)
-        is_endgame = chess.popcount(self.board.occupied) <= 7
+        if not self._is_chessdb_eligible(self.board) or not has_time:
+            return
 
-        if out_of_book or too_deep or too_many_moves or not has_time or is_endgame:
+        try:
+            response = await self._request_chessdb_eval(self.board, self._get_move_budget())
+        except SourceUnavailableException:
             return
 
-        start_time = time.perf_counter()
-        response = await self.api.get_chessdb_eval(self.board.fen(), self.config.online_moves.chessdb.timeout)
         if response is None:
-            self.out_of_chessdb_counter += 1
-            self._reduce_own_time(time.perf_counter() - start_time)
-            return
+            return Online_Result('chessdb', is_out_of_book=True)
 
         if response['status'] != 'ok':
-            self.out_of_chessdb_counter += 1
-            return
+            return Online_Result('chessdb', is_out_of_book=True)
 
-        self.out_of_chessdb_counter = 0
         if self.config.online_moves.chessdb.selection == 'optimal' or response['moves'][0]['rank'] == 0:
             candidate_moves = [chessdb_move for chessdb_move in response['moves']
                                if chessdb_move['score'] == response['moves'][0]['score']]
@@ -512,49 +583,28 @@ class Lichess_Game:
             if not self._is_repetition(move):
                 break
         else:
-            return
+            return Online_Result('chessdb')
 
-        self.chessdb_counter += 1
         pov_score = chess.engine.PovScore(chess.engine.Cp(chessdb_move['score']), self.board.turn)
         candidates = (f'Candidates: {", ".join(chessdb_move["san"] for chessdb_move in candidate_moves)}'
                       if len(candidate_moves) > 1 else '')
         message = f'ChessDB: {self._format_move(move):14} {self._format_score(pov_score)}     {candidates}'
-        return Move_Response(move, message)
+        return Online_Result('chessdb', Move_Response(move, message))
 
-    def _probe_gaviota(self, moves: Iterable[chess.Move]) -> Gaviota_Result:
-        assert self.gaviota_tablebase
-
-        best_moves: list[chess.Move] = []
-        best_wdl = -2
-        best_dtm = 1_000_000
-        for move in moves:
-            board_copy = self.board.copy(stack=False)
-            board_copy.push(move)
+    def _is_chessdb_eligible(self, board: chess.Board) -> bool:
+        out_of_book = self.out_of_chessdb_counter >= 5
+        too_deep = (False
+                    if self.config.online_moves.chessdb.max_depth is None
+                    else board.ply() >= self.config.online_moves.chessdb.max_depth)
+        too_many_moves = (False
+                          if self.config.online_moves.chessdb.max_moves is None
+                          else self.chessdb_counter >= self.config.online_moves.chessdb.max_moves)
+        is_endgame = chess.popcount(board.occupied) <= 7
 
-            if board_copy.is_checkmate():
-                wdl = 2
-                dtm = 0
-            else:
-                dtm = -self.gaviota_tablebase.probe_dtm(board_copy)
-                wdl = self._value_to_wdl(dtm, board_copy.halfmove_clock)
-
-            if best_moves:
-                if wdl > best_wdl:
-                    best_moves = [move]
-                    best_wdl = wdl
-                    best_dtm = dtm
-                elif wdl == best_wdl:
-                    if dtm < best_dtm:
-                        best_moves = [move]
-                        best_dtm = dtm
-                    elif dtm == best_dtm:
-                        best_moves.append(move)
-            else:
-                best_moves.append(move)
-                best_wdl = wdl
-                best_dtm = dtm
+        return not (out_of_book or too_deep or too_many_moves or is_endgame)
 
-        return Gaviota_Result(best_moves, best_wdl, best_dtm)
+    async def _request_chessdb_eval(self, board: chess.Board, budget: float) -> dict[str, Any] | None:
+        return await self.api.get_chessdb_eval(board.fen(), self.config.online_moves.chessdb.timeout, budget)
 
     async def _make_gaviota_move(self) -> Move_Response | None:
         match chess.popcount(self.board.occupied):
@@ -565,16 +615,20 @@ class Lichess_Game:
                     return
 
                 try:
-                    result = self._probe_gaviota(self.board.generate_legal_captures())
-                except KeyError:
+                    result = await self.tablebase_prober.probe_gaviota(self.board,
+                                                                       self.board.generate_legal_captures(),
+                                                                       self._get_probe_timeout())
+                except (KeyError, TimeoutError):
                     return
 
                 if result.wdl < 2:
                     return
             case _:
                 try:
-                    result = self._probe_gaviota(self.board.generate_legal_moves())
-                except KeyError:
+                    result = await self.tablebase_prober.probe_gaviota(self.board,
+                                                                       self.board.generate_legal_moves(),
+                                                                       self._get_probe_timeout())
+                except (KeyError, TimeoutError):
                     return
 
         match result.wdl:
@@ -598,64 +652,28 @@ class Lichess_Game:
         message = f'Gaviota: {self._format_move(move):14} {egtb_info}'
         return Move_Response(move, message, is_drawish=offer_draw, is_resignable=resign)
 
-    def _probe_syzygy(self, moves: Iterable[chess.Move]) -> Syzygy_Result:
-        assert self.syzygy_tablebase
-
-        best_moves: list[chess.Move] = []
-        best_wdl = -2
-        best_dtz = 1_000_000
-        best_real_dtz = best_dtz
-        for move in moves:
-            board_copy = self.board.copy(stack=False)
-            board_copy.push(move)
-
-            dtz = -self.syzygy_tablebase.probe_dtz(board_copy)
-            wdl = self._value_to_wdl(dtz, board_copy.halfmove_clock)
-
-            real_dtz = dtz
-            if board_copy.halfmove_clock == 0:
-                if wdl < 0:
-                    dtz += 10_000
-                elif wdl > 0:
-                    dtz -= 10_000
-
-            if best_moves:
-                if wdl > best_wdl:
-                    best_moves = [move]
-                    best_wdl = wdl
-                    best_dtz = dtz
-                    best_real_dtz = real_dtz
-                elif wdl == best_wdl:
-                    if dtz < best_dtz:
-                        best_moves = [move]
-                        best_dtz = dtz
-                        best_real_dtz = real_dtz
-                    elif dtz == best_dtz:
-                        best_moves.append(move)
-            else:
-                best_moves.append(move)
-                best_wdl = wdl
-                best_dtz = dtz
-                best_real_dtz = real_dtz
-
-        return Syzygy_Result(best_moves, best_wdl, best_real_dtz)
-
     async def _make_syzygy_move(self) -> Move_Response | None:
         match chess.popcount(self.board.occupied):
             case pieces if pieces > self.syzygy_config.max_pieces + 1 or self._has_mate_score():
                 return
             case pieces if pieces == self.syzygy_config.max_pieces + 1:
                 try:
-                    result = self._probe_syzygy(self.board.generate_legal_captures())
-                except KeyError:
+                    result = await self.tablebase_prober.probe_syzygy(self.board,
+                                                                      list(self.board.generate_legal_captures()),
+                                                                      self.engine,
+                                                                      self._get_probe_timeout())
+                except (KeyError, TimeoutError):
                     return
 
                 if result.wdl < 2:
                     return
             case _:
                 try:
-                    result = self._probe_syzygy(self.board.generate_legal_moves())
-                except KeyError:
+                    result = await self.tablebase_prober.probe_syzygy(self.board,
+                                                                      list(self.board.generate_legal_moves()),
+                                                                      self.engine,
+                                                                      self._get_probe_timeout())
+                except (KeyError, TimeoutError):
                     return
 
         match result.wdl:
@@ -685,43 +703,6 @@ class Lichess_Game:
         message = f'Syzygy:  {self._format_move(move):14} {egtb_info}'
         return Move_Response(move, message, is_drawish=offer_draw, is_resignable=resign)
 
-    def _value_to_wdl(self, value: int, halfmove_clock: int) -> Literal[-2, -1, 0, 1, 2]:
-        if value > 0:
-            if value + halfmove_clock <= 100:
-                return 2
-
-            return 1
-
-        if value < 0:
-            if value - halfmove_clock >= -100:
-                return -2
-
-            return -1
-
-        return 0
-
-    def _get_syzygy_tablebase(self) -> chess.syzygy.Tablebase | None:
-        if not (self.syzygy_config.enabled and self.syzygy_config.instant_play):
-            return
-
-        tablebase = chess.syzygy.open_tablebase(self.syzygy_config.paths[0], VariantBoard=type(self.board))
-
-        for path in self.syzygy_config.paths[1:]:
-            tablebase.add_directory(path)
-
-        return tablebase
-
-    def _get_gaviota_tablebase(self) -> chess.gaviota.PythonTablebase | chess.gaviota.NativeTablebase | None:
-        if not self.config.gaviota.enabled:
-            return
-
-        tablebase = chess.gaviota.open_tablebase(self.config.gaviota.paths[0])
-
-        for path in self.config.gaviota.paths[1:]:
-            tablebase.add_directory(path)
-
-        return tablebase
-
     async def _make_egtb_move(self) -> Move_Response | None:
         max_pieces = 7 if self.board.uci_variant == 'chess' else 6
         match chess.popcount(self.board.occupied):
@@ -738,7 +719,14 @@ class Lichess_Game:
         assert variant
 
         start_time = time.perf_counter()
-        response = await self.api.get_egtb(self.board.fen(), variant, self.config.online_moves.online_egtb.timeout)
+        try:
+            response = await self.api.get_egtb(self.board.fen(),
+                                               variant,
+                                               self.config.online_moves.online_egtb.timeout,
+                                               self._get_move_budget())
+        except SourceUnavailableException:
+            return
+
         if response is None:
             self._reduce_own_time(time.perf_counter() - start_time)
             return
@@ -770,8 +758,8 @@ class Lichess_Game:
 
         info_depth = info.get('depth')
         info_seldepth = info.get('seldepth')
-        depth_str = f'{info_depth}/{info_seldepth}'
-        depth = f'{depth_str:6}' if info_depth and info_seldepth else 6 * ' '
+        depth_str = f'{info_depth}/{info_seldepth}' if info_seldepth else f'{info_depth}'
+        depth = f'{depth_str:6}' if info_depth else 6 * ' '
 
         info_nodes = info.get('nodes')
         nodes = f'Nodes: {self._format_number(info_nodes)}' if info_nodes else 14 * ' '
@@ -852,28 +840,99 @@ class Lichess_Game:
             if self.board.uci_variant in ['chess', 'antichess', 'atomic']:
                 move_sources.append(self._make_egtb_move)
 
-        opening_sources: dict[Callable[[], Awaitable[Move_Response | None]], int] = {}
+        is_book_pending = self.config.opening_books.enabled
+        online_sources: dict[Callable[[], Awaitable[Online_Result | None]], int] = {}
+        prioritized_sources = sorted(self.online_sources.items(), key=lambda item: item[1][0], reverse=True)
+        for online_source, (priority, timeout) in prioritized_sources:
+            if is_book_pending and priority <= self.config.opening_books.priority:
+                if online_sources:
+                    move_sources.append(partial(self._race_online_sources, online_sources))
+                    online_sources = {}
+
+                move_sources.append(self._make_book_move)
+                is_book_pending = False
 
-        if self.config.opening_books.enabled:
-            opening_sources[self._make_book_move] = self.config.opening_books.priority
+            online_sources[online_source] = timeout
+
+        if online_sources:
+            move_sources.append(partial(self._race_online_sources, online_sources))
+
+        if is_book_pending:
+            move_sources.append(self._make_book_move)
+
+        return move_sources
+
+    def _get_online_sources(self) -> dict[Callable[[], Awaitable[Online_Result | None]], tuple[int, int]]:
+        online_sources: dict[Callable[[], Awaitable[Online_Result | None]], tuple[int, int]] = {}
 
         if self.config.online_moves.opening_explorer.enabled:
             if self.board.uci_variant == 'chess' or self.config.online_moves.opening_explorer.use_for_variants:
-                opening_sources[self._make_opening_explorer_move] = self.config.online_moves.opening_explorer.priority
+                online_sources[self._make_opening_explorer_move] = (
+                    self.config.online_moves.opening_explorer.priority,
+                    self.config.online_moves.opening_explorer.timeout)
 
         if self.config.online_moves.lichess_cloud.enabled:
-            if not (self.config.online_moves.lichess_cloud.only_without_book and self.book_settings.readers):
-                opening_sources[self._make_cloud_move] = self.config.online_moves.lichess_cloud.priority
+            if not (self.config.online_moves.lichess_cloud.only_without_book and self.book_settings.index):
+                online_sources[self._make_cloud_move] = (self.config.online_moves.lichess_cloud.priority,
+                                                         self.config.online_moves.lichess_cloud.timeout)
 
         if self.config.online_moves.chessdb.enabled:
             if self.board.uci_variant == 'chess':
-                opening_sources[self._make_chessdb_move] = self.config.online_moves.chessdb.priority
+                online_sources[self._make_chessdb_move] = (self.config.online_moves.chessdb.priority,
+                                                           self.config.online_moves.chessdb.timeout)
 
-        move_sources += [opening_source
-                         for opening_source, _
-                         in sorted(opening_sources.items(), key=lambda item: item[1], reverse=True)]
+        return online_sources
 
-        return move_sources
+    async def _race_online_sources(self,
+                                   online_sources: dict[Callable[[], Awaitable[Online_Result | None]], int]
+                                   ) -> Move_Response | None:
+        start_time = time.perf_counter()
+        self._start_speculative_search()
+        online_results = await race_online_sources(online_sources, self._get_online_budget(online_sources.values()))
+        for online_result in online_results:
+            self._record_online_result(online_result)
+
+        if online_results and online_results[-1].move_response:
+            return online_results[-1].move_response
+
+        self._reduce_own_time(time.perf_counter() - start_time)
+
+    def _record_online_result(self, online_result: Online_Result) -> None:
+        is_move = online_result.move_response is not None
+        match online_result.source:
+            case 'opening_explorer':
+                self.out_of_opening_explorer_counter = (self.out_of_opening_explorer_counter + 1
+                                                        if online_result.is_out_of_book else 0)
+                self.opening_explorer_counter += is_move
+            case 'lichess_cloud':
+                self.out_of_cloud_counter = self.out_of_cloud_counter + 1 if online_result.is_out_of_book else 0
+                self.cloud_counter += is_move
+            case 'chessdb':
+                self.out_of_chessdb_counter = self.out_of_chessdb_counter + 1 if online_result.is_out_of_book else 0
+                self.chessdb_counter += is_move
+
+    def _get_online_budget(self, timeouts: Iterable[int]) -> float:
+        return min(max(timeouts), self._get_move_budget())
+
+    def _get_move_budget(self) -> float:
+        if len(self.board.move_stack) < 2:
+            return float('inf')
+
+        return max(self.own_time - self.move_overhead, 0.0) / ONLINE_BUDGET_DIVISOR + self.increment
+
+    def _get_book_replies(self) -> list[chess.Move]:
+        if not self.book_settings.index:
+            return []
+
+        books = self.book_registry.find_all(self.book_settings.index, self.board)
+        return [entry.move for _, book_position in sorted(books.items()) for entry in book_position.entries]
+
+    def _get_online_requests(self) -> list[Online_Request]:
+        online_requests: dict[Callable[[], Awaitable[Online_Result | None]], Online_Request] = {
+            self._make_opening_explorer_move: (self._is_opening_explorer_eligible, self._request_opening_explorer),
+            self._make_cloud_move: (self._is_cloud_eligible, self._request_cloud_eval),
+            self._make_chessdb_move: (self._is_chessdb_eligible, self._request_chessdb_eval)}
+        return [online_requests[online_source] for online_source in self.online_sources]
 
     def _get_move_overhead(self, engine_config: Engine_Config) -> float:
         move_overhead_multiplier = (1.0
@@ -881,6 +940,9 @@ class Lichess_Game:
                                     else engine_config.move_overhead_multiplier)
         return max(self.game_info.initial_time_ms / 60_000 * move_overhead_multiplier, 1.0)
 
+    def _get_probe_timeout(self) -> float:
+        return max(self.own_time / 20, 0.1)
+
     def _has_time(self, min_time: float) -> bool:
         if len(self.board.move_stack) < 2:
             return True
@@ -899,10 +961,28 @@ class Lichess_Game:
         else:
             self.black_time -= seconds
 
+    @staticmethod
+    def _get_position_counts(board: chess.Board) -> Counter[int]:
+        board = board.copy()
+        position_counts: Counter[int] = Counter([chess.polyglot.zobrist_hash(board)])
+        while board.move_stack:
+            board.pop()
+            position_counts[chess.polyglot.zobrist_hash(board)] += 1
+
+        return position_counts
+
+    def _push(self, move: chess.Move) -> None:
+        self.board.push(move)
+        self.position_counts[chess.polyglot.zobrist_hash(self.board)] += 1
+
     def _is_repetition(self, move: chess.Move) -> bool:
-        board = self.board.copy()
-        board.push(move)
-        return board.is_repetition(count=2)
+        self.board.push(move)
+        if self.board.uci_variant in ZOBRIST_INCOMPLETE_VARIANTS:
+            is_repetition = self.board.is_repetition(count=2)
+        else:
+            is_repetition = chess.polyglot.zobrist_hash(self.board) in self.position_counts
+        self.board.pop()
+        return is_repetition
 
     def _has_mate_score(self) -> bool:
         if not self.scores:
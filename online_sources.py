@@ -0,0 +1,88 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+import chess
+
+from api import API
+from botli_dataclasses import Online_Result
+
+PREFETCH_REPLIES = 2
+
+Online_Request = tuple[Callable[[chess.Board], bool],
+                       Callable[[chess.Board, float], Awaitable[dict[str, Any] | None]]]
+
+
+async def race_online_sources(online_sources: Iterable[Callable[[], Awaitable[Online_Result | None]]],
+                              budget: float) -> list[Online_Result]:
+    online_results: list[Online_Result] = []
+    tasks = [asyncio.ensure_future(online_source()) for online_source in online_sources]
+    try:
+        async with asyncio.timeout(budget):
+            for task in tasks:
+                if online_result := await task:
+                    online_results.append(online_result)
+                    if online_result.move_response:
+                        break
+    except TimeoutError:
+        print('Online move sources exceeded their time budget.')
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    return online_results
+
+
+class Reply_Prefetcher:
+    def __init__(self, api: API, online_requests: list[Online_Request]) -> None:
+        self.api = api
+        self.online_requests = online_requests
+        self.task: asyncio.Task[None] | None = None
+        self.replies: set[chess.Move] = set()
+        self.predictions = 0
+        self.hits = 0
+
+    def start(self, board: chess.Board, predicted_replies: list[chess.Move]) -> None:
+        if not self.is_active or board.is_game_over():
+            return
+
+        replies = [reply for reply in dict.fromkeys(predicted_replies) if board.is_legal(reply)][:PREFETCH_REPLIES]
+        if not replies:
+            return
+
+        if self.task:
+            self.task.cancel()
+
+        self.replies = set(replies)
+        self.task = asyncio.create_task(self._prefetch(board.copy(stack=False), replies))
+
+    def record_reply(self, move: chess.Move) -> None:
+        if not self.replies:
+            return
+
+        self.predictions += 1
+        self.hits += move in self.replies
+        self.replies.clear()
+
+    async def _prefetch(self, board: chess.Board, replies: list[chess.Move]) -> None:
+        requests: list[Awaitable[dict[str, Any] | None]] = []
+        for reply in replies:
+            reply_board = board.copy(stack=False)
+            reply_board.push(reply)
+            for is_eligible, request in self.online_requests:
+                if is_eligible(reply_board):
+                    requests.append(request(reply_board, float('inf')))
+
+        await asyncio.gather(*requests, return_exceptions=True)
+
+    def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+
+    @property
+    def is_active(self) -> bool:
+        return bool(self.api.response_cache and self.online_requests)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.predictions if self.predictions else 0.0
@@ -0,0 +1,118 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any
+
+import chess
+import chess.polyglot
+
+from api import API, SourceUnavailableException
+from configs import Opening_Explorer_Config
+from enums import Variant
+
+DEFAULT_REPERTOIRE_DEPTH = 16
+MAX_REPERTOIRE_REQUESTS = 32
+REPERTOIRE_BRANCHES = 2
+MAX_REPERTOIRES = 16
+
+Repertoire_Key = tuple[str, str, Variant, str]
+
+
+class Repertoire_Prefetcher:
+    def __init__(self, api: API, opening_explorer_config: Opening_Explorer_Config) -> None:
+        self.api = api
+        self.opening_explorer_config = opening_explorer_config
+        self.repertoires: OrderedDict[Repertoire_Key, dict[int, dict[str, Any]]] = OrderedDict()
+        self.tasks: dict[Repertoire_Key, asyncio.Task[None]] = {}
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start_prefetch(self, username: str, color: str, variant: Variant, speeds: str, board: chess.Board) -> None:
+        key = (username.lower(), color, variant, speeds)
+        if key in self.tasks:
+            return
+
+        self.repertoires.setdefault(key, {})
+        self.repertoires.move_to_end(key)
+        while len(self.repertoires) > MAX_REPERTOIRES:
+            self.repertoires.popitem(last=False)
+
+        task = asyncio.create_task(self._prefetch(key, board.copy(stack=False)))
+        task.add_done_callback(lambda _: self.tasks.pop(key, None))
+        self.tasks[key] = task
+
+    async def _prefetch(self, key: Repertoire_Key, root_board: chess.Board) -> None:
+        username, color, variant, speeds = key
+        max_depth = (DEFAULT_REPERTOIRE_DEPTH
+                     if self.opening_explorer_config.max_depth is None
+                     else self.opening_explorer_config.max_depth)
+        repertoire = self.repertoires[key]
+        requests = 0
+        boards = deque([root_board])
+        while boards and requests < MAX_REPERTOIRE_REQUESTS:
+            board = boards.popleft()
+            if board.ply() >= max_depth or board.fullmove_number > 25:
+                continue
+
+            position_key = chess.polyglot.zobrist_hash(board)
+            if (response := repertoire.get(position_key)) is None:
+                response = self.api.get_cached_opening_explorer(username, board.fen(), variant, color, speeds)
+                if response is None:
+                    try:
+                        response = await self.api.get_opening_explorer(username, board.fen(), variant, color, speeds,
+                                                                       self.opening_explorer_config.timeout,
+                                                                       self.opening_explorer_config.timeout,
+                                                                       use_cache=False)
+                    except SourceUnavailableException:
+                        return
+
+                    requests += 1
+                    self.requests += 1
+                    if response is None:
+                        continue
+
+                repertoire[position_key] = response
+
+            if response['white'] + response['draws'] + response['black'] < self.opening_explorer_config.min_games:
+                continue
+
+            for move in sorted(response['moves'],
+                               key=lambda move: move['white'] + move['draws'] + move['black'],
+                               reverse=True)[:REPERTOIRE_BRANCHES]:
+                next_board = board.copy(stack=False)
+                next_board.push_uci(move['uci'])
+                boards.append(next_board)
+
+    def get(self,
+            username: str,
+            color: str,
+            variant: Variant,
+            speeds: str,
+            board: chess.Board
+            ) -> dict[str, Any] | None:
+        repertoire = self.repertoires.get((username.lower(), color, variant, speeds), {})
+        if response := repertoire.get(chess.polyglot.zobrist_hash(board)):
+            self.hits += 1
+            return response
+
+        self.misses += 1
+
+    def close(self) -> None:
+        for task in list(self.tasks.values()):
+            task.cancel()
+
+        self.repertoires.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Repertoires: {len(self.repertoires)} '
+                               f'({sum(len(repertoire) for repertoire in self.repertoires.values())} positions)',
+                               f'Prefetching: {len(self.tasks)}',
+                               f'Requests: {self.requests}',
+                               f'Hit rate: {self.hit_rate * 100:.1f} %'))
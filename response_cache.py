@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Any
+
+from configs import Online_Cache_Config
+
+RESPONSE_CACHE_PATH = '.response_cache.sqlite3'
+COUNTER_SENSITIVE_SOURCES = {'online_egtb'}
+EVICTION_RATIO = 0.9
+
+
+class Response_Cache:
+    def __init__(self, cache_config: Online_Cache_Config, path: str = RESPONSE_CACHE_PATH) -> None:
+        self.ttls = cache_config.ttls
+        self.negative_ttl = cache_config.negative_ttl * 3600
+        self.max_size = cache_config.max_size * 1024 * 1024
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                'key BLOB PRIMARY KEY, source TEXT NOT NULL, response TEXT NOT NULL, '
+                                'is_miss INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL, '
+                                'size INTEGER NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.connection.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+        self.size: int = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.hits: defaultdict[str, int] = defaultdict(int)
+        self.negative_hits: defaultdict[str, int] = defaultdict(int)
+        self.misses: defaultdict[str, int] = defaultdict(int)
+        self.fetches: defaultdict[str, int] = defaultdict(int)
+        self.fetch_time: defaultdict[str, float] = defaultdict(float)
+        self.lookups = 0
+        self.lookup_time = 0.0
+        self.evictions = 0
+
+    def get(self, source: str, params: dict[str, Any]) -> dict[str, Any] | None:
+        start_time = time.perf_counter()
+        key = self.get_key(source, params)
+        row = self.connection.execute('SELECT response, is_miss, expires, size FROM responses WHERE key = ?',
+                                      (key,)).fetchone()
+        now = time.time()
+        if row and row[2] < now:
+            self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.size -= row[3]
+            row = None
+
+        if row:
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            if row[1]:
+                self.negative_hits[source] += 1
+            else:
+                self.hits[source] += 1
+        else:
+            self.misses[source] += 1
+
+        self.lookups += 1
+        self.lookup_time += time.perf_counter() - start_time
+        return json.loads(row[0]) if row else None
+
+    def put(self, source: str, params: dict[str, Any], response: dict[str, Any], is_miss: bool) -> None:
+        key = self.get_key(source, params)
+        serialized_response = json.dumps(response, separators=(',', ':'))
+        now = time.time()
+        ttl = self.negative_ttl if is_miss else self.ttls[source] * 3600
+        if old_row := self.connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone():
+            self.size -= old_row[0]
+
+        self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (key, source, serialized_response, is_miss, now + ttl, now,
+                                 len(serialized_response)))
+        self.size += len(serialized_response)
+
+        if self.size > self.max_size:
+            self._evict()
+
+    def record_fetch(self, source: str, seconds: float) -> None:
+        self.fetches[source] += 1
+        self.fetch_time[source] += seconds
+
+    def _evict(self) -> None:
+        target_size = self.max_size * EVICTION_RATIO
+        self.connection.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+        self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        while self.size > target_size:
+            rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 256').fetchall()
+            if not rows:
+                break
+
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', ((key,) for key, _ in rows))
+            self.size -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    @staticmethod
+    def get_key(source: str, params: dict[str, Any]) -> bytes:
+        if 'fen' in params and source not in COUNTER_SENSITIVE_SOURCES:
+            params = {**params, 'fen': ' '.join(params['fen'].split()[:4])}
+
+        return hashlib.blake2b(json.dumps([source, params], sort_keys=True).encode(), digest_size=16).digest()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @property
+    def hit_rate(self) -> float:
+        hits = sum(self.hits.values()) + sum(self.negative_hits.values())
+        lookups = hits + sum(self.misses.values())
+        return hits / lookups if lookups else 0.0
+
+    @property
+    def average_lookup_time(self) -> float:
+        return self.lookup_time / self.lookups if self.lookups else 0.0
+
+    def __str__(self) -> str:
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Response cache: {self.size / 1024 / 1024:.1f} MB',
+                               f'Hit rate: {self.hit_rate * 100:.1f} %',
+                               *(f'{source}: {self.hits[source]}/{self.negative_hits[source]}/'
+                                 f'{self.misses[source]} hits/negative/misses'
+                                 for source in {**self.hits, **self.negative_hits, **self.misses}),
+                               *(f'{source} fetch: {self.fetch_time[source] / fetches * 1000:.0f} ms avg'
+                                 for source, fetches in self.fetches.items()),
+                               f'Avg lookup: {self.average_lookup_time * 1_000_000:.0f} µs',
+                               f'Evictions: {self.evictions}'))
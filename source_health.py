@@ -0,0 +1,83 @@
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Literal
+
+EWMA_ALPHA = 0.2
+FAILURE_THRESHOLD = 3
+MIN_SUCCESS_RATE = 0.5
+MIN_COOLDOWN = 30.0
+MAX_COOLDOWN = 600.0
+
+
+@dataclass
+class Source_Health:
+    latency: float | None = None
+    success_rate: float = 1.0
+    state: Literal['closed', 'open', 'half_open'] = 'closed'
+    consecutive_failures: int = 0
+    cooldown: float = MIN_COOLDOWN
+    next_probe: float = 0.0
+
+
+class Source_Health_Monitor:
+    def __init__(self) -> None:
+        self.sources: defaultdict[str, Source_Health] = defaultdict(Source_Health)
+        self.skips: defaultdict[str, int] = defaultdict(int)
+        self.probes: defaultdict[str, int] = defaultdict(int)
+
+    def is_available(self, source: str, budget: float) -> bool:
+        health = self.sources[source]
+        now = time.monotonic()
+        if health.state == 'open':
+            if now < health.next_probe:
+                self.skips[source] += 1
+                return False
+
+            health.state = 'half_open'
+
+        is_too_slow = health.latency is not None and health.latency > budget
+        if health.state == 'half_open' or is_too_slow:
+            if now < health.next_probe:
+                self.skips[source] += 1
+                return False
+
+            health.next_probe = now + health.cooldown
+            self.probes[source] += 1
+
+        return True
+
+    def record(self, source: str, seconds: float, success: bool) -> None:
+        health = self.sources[source]
+        health.latency = (seconds if health.latency is None
+                          else EWMA_ALPHA * seconds + (1.0 - EWMA_ALPHA) * health.latency)
+        health.success_rate = EWMA_ALPHA * success + (1.0 - EWMA_ALPHA) * health.success_rate
+
+        if success:
+            health.consecutive_failures = 0
+            if health.state == 'half_open':
+                print(f'Online source "{source}" has recovered.')
+                health.state = 'closed'
+                health.cooldown = MIN_COOLDOWN
+            return
+
+        health.consecutive_failures += 1
+        if health.state == 'half_open':
+            health.cooldown = min(health.cooldown * 2.0, MAX_COOLDOWN)
+        elif health.consecutive_failures < FAILURE_THRESHOLD and health.success_rate >= MIN_SUCCESS_RATE:
+            return
+
+        if health.state != 'open':
+            print(f'Online source "{source}" is failing. Pausing it for {health.cooldown:.0f} seconds.')
+
+        health.state = 'open'
+        health.next_probe = time.monotonic() + health.cooldown
+
+    def __str__(self) -> str:
+        delimiter = 5 * ' '
+
+        return delimiter.join(('Online sources:',
+                               *(f'{source}: {health.state} '
+                                 f'({(health.latency or 0.0) * 1000:.0f} ms, {health.success_rate * 100:.0f} % ok, '
+                                 f'{self.skips[source]} skipped, {self.probes[source]} probes)'
+                                 for source, health in self.sources.items())))
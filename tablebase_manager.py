@@ -0,0 +1,304 @@
+import asyncio
+import ctypes
+import ctypes.util
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+import chess
+import chess.gaviota
+import chess.polyglot
+import chess.syzygy
+from chess.variant import find_variant
+
+from configs import Gaviota_Config, Syzygy_Config
+
+Gaviota_Tablebase = chess.gaviota.PythonTablebase | chess.gaviota.NativeTablebase
+TABLEBASE_EXTENSIONS = ('.rtbw', '.rtbz', '.stbw', '.stbz', '.atbw', '.atbz', '.gtb.cp4')
+PROBE_WORKERS = 2
+DTM_CACHE_SIZE = 65536
+LOOP_LAG_INTERVAL = 0.1
+T = TypeVar('T')
+
+
+class Tablebase_Manager:
+    def __init__(self,
+                 syzygy_configs: dict[str, Syzygy_Config],
+                 gaviota_config: Gaviota_Config,
+                 preload_pieces: int | None,
+                 lock_preloaded: bool) -> None:
+        self.syzygy_configs = syzygy_configs
+        self.gaviota_config = gaviota_config
+        self.preload_pieces = preload_pieces
+        self.lock_preloaded = lock_preloaded
+        self.syzygy_tablebases: dict[tuple[str, ...], chess.syzygy.Tablebase] = {}
+        self.gaviota_tablebases: dict[tuple[str, ...], Gaviota_Tablebase] = {}
+        self.references: dict[tuple[str, ...], int] = {}
+        self.persistent_keys: set[tuple[str, ...]] = set()
+        self.preload_task: asyncio.Task[None] | None = None
+        self.preloaded_files = 0
+        self.preloaded_size = 0
+        self.locked_files: list[tuple[int, int]] = []
+        self.executor = ThreadPoolExecutor(PROBE_WORKERS, thread_name_prefix='tablebase')
+        self.serial_executor = ThreadPoolExecutor(1, thread_name_prefix='tablebase_serial')
+        self.probes = 0
+        self.probe_timeouts = 0
+        self.probe_time = 0.0
+        self.backend_probes: defaultdict[str, int] = defaultdict(int)
+        self.backend_probe_time: defaultdict[str, float] = defaultdict(float)
+        self.dtm_cache: OrderedDict[int, int] = OrderedDict()
+        self.dtm_cache_hits = 0
+        self.dtm_cache_misses = 0
+        self.loop_lag_task: asyncio.Task[None] | None = None
+        self.loop_lag_samples = 0
+        self.total_loop_lag = 0.0
+        self.max_loop_lag = 0.0
+
+    async def start(self) -> None:
+        self.loop_lag_task = asyncio.create_task(self._monitor_loop_lag())
+
+        paths: list[str] = []
+        for key, syzygy_config in self.syzygy_configs.items():
+            if syzygy_config.enabled and syzygy_config.instant_play:
+                self.persistent_keys.add(self._get_syzygy_key(syzygy_config, find_variant(key)))
+                self._get_syzygy_tablebase(syzygy_config, find_variant(key))
+                paths.extend(syzygy_config.paths)
+
+        if self.gaviota_config.enabled:
+            self.persistent_keys.add(self._get_gaviota_key(self.gaviota_config))
+            self._get_gaviota_tablebase(self.gaviota_config)
+            paths.extend(self.gaviota_config.paths)
+
+        if self.preload_pieces and paths:
+            self.preload_task = asyncio.create_task(asyncio.to_thread(self._preload, paths))
+
+    async def probe(self,
+                    function: Callable[..., T],
+                    *args: Any,
+                    stop_event: threading.Event,
+                    timeout: float,
+                    serial: bool = False) -> T:
+        executor = self.serial_executor if serial else self.executor
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(executor, function, *args, stop_event), timeout)
+        except TimeoutError:
+            self.probe_timeouts += 1
+            raise
+        finally:
+            stop_event.set()
+            self.probes += 1
+            self.probe_time += time.perf_counter() - start_time
+
+    def record_backend_probe(self, backend: str, seconds: float) -> None:
+        self.backend_probes[backend] += 1
+        self.backend_probe_time[backend] += seconds
+
+    def probe_dtm(self, tablebase: Gaviota_Tablebase, board: chess.Board) -> int:
+        key = chess.polyglot.zobrist_hash(board)
+        if key in self.dtm_cache:
+            self.dtm_cache.move_to_end(key)
+            self.dtm_cache_hits += 1
+            return self.dtm_cache[key]
+
+        dtm = tablebase.probe_dtm(board)
+        self.dtm_cache[key] = dtm
+        self.dtm_cache_misses += 1
+        if len(self.dtm_cache) > DTM_CACHE_SIZE:
+            self.dtm_cache.popitem(last=False)
+
+        return dtm
+
+    async def _monitor_loop_lag(self) -> None:
+        while True:
+            start_time = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            loop_lag = max(time.perf_counter() - start_time - LOOP_LAG_INTERVAL, 0.0)
+            self.loop_lag_samples += 1
+            self.total_loop_lag += loop_lag
+            self.max_loop_lag = max(self.max_loop_lag, loop_lag)
+
+    def acquire_syzygy(self,
+                       syzygy_config: Syzygy_Config,
+                       VariantBoard: type[chess.Board]) -> chess.syzygy.Tablebase:
+        tablebase = self._get_syzygy_tablebase(syzygy_config, VariantBoard)
+        self.references[self._get_syzygy_key(syzygy_config, VariantBoard)] += 1
+        return tablebase
+
+    def acquire_gaviota(self,
+                        gaviota_config: Gaviota_Config) -> Gaviota_Tablebase:
+        tablebase = self._get_gaviota_tablebase(gaviota_config)
+        self.references[self._get_gaviota_key(gaviota_config)] += 1
+        return tablebase
+
+    def release(self,
+                tablebase: chess.syzygy.Tablebase | Gaviota_Tablebase) -> None:
+        for key, open_tablebase in self.tablebases.items():
+            if open_tablebase is not tablebase:
+                continue
+
+            self.references[key] -= 1
+            if not self.references[key] and key not in self.persistent_keys:
+                tablebase.close()
+                self.syzygy_tablebases.pop(key, None)
+                self.gaviota_tablebases.pop(key, None)
+                del self.references[key]
+
+            return
+
+    @property
+    def tablebases(self) -> dict[tuple[str, ...], chess.syzygy.Tablebase | Gaviota_Tablebase]:
+        return {**self.syzygy_tablebases, **self.gaviota_tablebases}
+
+    def _get_syzygy_tablebase(self,
+                              syzygy_config: Syzygy_Config,
+                              VariantBoard: type[chess.Board]) -> chess.syzygy.Tablebase:
+        key = self._get_syzygy_key(syzygy_config, VariantBoard)
+        if key not in self.syzygy_tablebases:
+            tablebase = chess.syzygy.open_tablebase(syzygy_config.paths[0], VariantBoard=VariantBoard)
+
+            for path in syzygy_config.paths[1:]:
+                tablebase.add_directory(path)
+
+            self.syzygy_tablebases[key] = tablebase
+            self.references[key] = 0
+
+        return self.syzygy_tablebases[key]
+
+    def _get_gaviota_tablebase(self,
+                               gaviota_config: Gaviota_Config) -> Gaviota_Tablebase:
+        key = self._get_gaviota_key(gaviota_config)
+        if key not in self.gaviota_tablebases:
+            tablebase = chess.gaviota.open_tablebase(gaviota_config.paths[0])
+
+            for path in gaviota_config.paths[1:]:
+                tablebase.add_directory(path)
+
+            self.gaviota_tablebases[key] = tablebase
+            self.references[key] = 0
+
+        return self.gaviota_tablebases[key]
+
+    @staticmethod
+    def _get_syzygy_key(syzygy_config: Syzygy_Config, VariantBoard: type[chess.Board]) -> tuple[str, ...]:
+        return ('syzygy', str(VariantBoard.uci_variant), *syzygy_config.paths)
+
+    @staticmethod
+    def _get_gaviota_key(gaviota_config: Gaviota_Config) -> tuple[str, ...]:
+        return ('gaviota', *gaviota_config.paths)
+
+    def _preload(self, paths: list[str]) -> None:
+        assert self.preload_pieces
+
+        if self.lock_preloaded and (sys.platform == 'win32' or not ctypes.util.find_library('c')):
+            print('Locking tablebase files in memory is not supported on this platform.')
+            self.lock_preloaded = False
+
+        for directory in dict.fromkeys(paths):
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(TABLEBASE_EXTENSIONS):
+                    continue
+
+                if len(name.split('.')[0].replace('v', '')) > self.preload_pieces:
+                    continue
+
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as tablebase_file:
+                    while tablebase_file.read(1 << 20):
+                        pass
+
+                self.preloaded_files += 1
+                self.preloaded_size += os.path.getsize(path)
+
+                if self.lock_preloaded and not self._lock_file(path):
+                    print(f'Could not lock "{path}" in memory. Check the RLIMIT_MEMLOCK of this process.')
+                    self.lock_preloaded = False
+
+        print(f'Preloaded {self.preloaded_files} tablebase files ({self.preloaded_size / 1024 / 1024:.0f} MB).')
+
+    def _lock_file(self, path: str) -> bool:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                              ctypes.c_long)
+        libc.mlock.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+        libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+
+        size = os.path.getsize(path)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            address = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        finally:
+            os.close(fd)
+
+        if address is None or address == ctypes.c_void_p(-1).value:
+            return False
+
+        if libc.mlock(address, size):
+            libc.munmap(address, size)
+            return False
+
+        self.locked_files.append((address, size))
+        return True
+
+    def close(self) -> None:
+        if self.preload_task:
+            self.preload_task.cancel()
+
+        if self.loop_lag_task:
+            self.loop_lag_task.cancel()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.serial_executor.shutdown(wait=False, cancel_futures=True)
+
+        for tablebase in self.tablebases.values():
+            tablebase.close()
+
+        self.syzygy_tablebases.clear()
+        self.gaviota_tablebases.clear()
+        self.references.clear()
+
+        if self.locked_files:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.munmap.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+            for address, size in self.locked_files:
+                libc.munmap(address, size)
+
+            self.locked_files.clear()
+
+    @property
+    def average_probe_time(self) -> float:
+        return self.probe_time / self.probes if self.probes else 0.0
+
+    @property
+    def dtm_cache_hit_rate(self) -> float:
+        dtm_probes = self.dtm_cache_hits + self.dtm_cache_misses
+        return self.dtm_cache_hits / dtm_probes if dtm_probes else 0.0
+
+    @property
+    def average_loop_lag(self) -> float:
+        return self.total_loop_lag / self.loop_lag_samples if self.loop_lag_samples else 0.0
+
+    def __str__(self) -> str:
+        locked_size = sum(size for _, size in self.locked_files)
+        delimiter = 5 * ' '
+
+        return delimiter.join((f'Tablebases: {len(self.tablebases)} open',
+                               f'References: {sum(self.references.values())}',
+                               f'Preloaded: {self.preloaded_files} files ({self.preloaded_size / 1024 / 1024:.0f} MB)',
+                               f'Locked: {len(self.locked_files)} files ({locked_size / 1024 / 1024:.0f} MB)',
+                               f'Probes: {self.probes}',
+                               f'Timeouts: {self.probe_timeouts}',
+                               f'Avg probe: {self.average_probe_time * 1000:.0f} ms',
+                               *(f'Syzygy {backend}: {self.backend_probe_time[backend] / probes * 1000:.0f} ms avg'
+                                 for backend, probes in self.backend_probes.items()),
+                               f'DTM cache: {self.dtm_cache_hit_rate * 100:.1f} % hits',
+                               f'Loop lag: {self.average_loop_lag * 1000:.1f} ms avg / '
+                               f'{self.max_loop_lag * 1000:.0f} ms max'))
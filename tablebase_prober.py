@@ -0,0 +1,273 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Callable, Iterable
+from typing import Literal, TypeVar
+
+import chess
+import chess.engine
+import chess.polyglot
+
+from botli_dataclasses import Gaviota_Result, Syzygy_Result
+from configs import Gaviota_Config, Syzygy_Config
+from engine import Engine
+from tablebase_manager import Tablebase_Manager
+
+SYZYGY_CACHE_SIZE = 4096
+PYTHON_SYZYGY_MAX_PIECES = 5
+ENGINE_TB_WIN_SCORE = 10_000
+T = TypeVar('T')
+
+
+class Tablebase_Prober:
+    def __init__(self,
+                 tablebase_manager: Tablebase_Manager,
+                 syzygy_config: Syzygy_Config,
+                 gaviota_config: Gaviota_Config,
+                 VariantBoard: type[chess.Board]) -> None:
+        self.tablebase_manager = tablebase_manager
+        self.syzygy_config = syzygy_config
+        self.syzygy_tablebase = (tablebase_manager.acquire_syzygy(syzygy_config, VariantBoard)
+                                 if syzygy_config.enabled and syzygy_config.instant_play else None)
+        self.gaviota_tablebase = tablebase_manager.acquire_gaviota(gaviota_config) if gaviota_config.enabled else None
+        self.syzygy_cache: OrderedDict[tuple[int, bool], int] = OrderedDict()
+        self.stop_event = threading.Event()
+
+    async def probe_gaviota(self, board: chess.Board, moves: Iterable[chess.Move], timeout: float) -> Gaviota_Result:
+        return await self._run_probe(self._probe_gaviota, board, moves, timeout, serial=True)
+
+    async def probe_syzygy(self,
+                           board: chess.Board,
+                           moves: list[chess.Move],
+                           engine: Engine,
+                           timeout: float) -> Syzygy_Result:
+        start_time = time.perf_counter()
+        if self._get_syzygy_backend(board, engine) == 'engine':
+            try:
+                result = await self._probe_syzygy_with_engine(board, moves, engine, timeout)
+                self.tablebase_manager.record_backend_probe('engine', time.perf_counter() - start_time)
+                return result
+            except (KeyError, chess.engine.EngineError, TimeoutError):
+                print('Engine could not rank the tablebase moves. Falling back to chess.syzygy ...')
+
+        timeout = max(timeout - (time.perf_counter() - start_time), 0.1)
+        result = await self._run_probe(self._probe_syzygy, board, moves, timeout)
+        self.tablebase_manager.record_backend_probe('python', time.perf_counter() - start_time)
+        return result
+
+    def close(self) -> None:
+        self.stop_event.set()
+
+        if self.syzygy_tablebase:
+            self.tablebase_manager.release(self.syzygy_tablebase)
+
+        if self.gaviota_tablebase:
+            self.tablebase_manager.release(self.gaviota_tablebase)
+
+    def _probe_gaviota(self,
+                       board: chess.Board,
+                       moves: list[chess.Move],
+                       stop_event: threading.Event) -> Gaviota_Result:
+        assert self.gaviota_tablebase
+
+        checks = [move for move in moves if board.gives_check(move)]
+        captures = [move for move in moves if move not in checks and board.is_capture(move)]
+        quiet_moves = [move for move in moves if move not in checks and move not in captures]
+
+        best_moves: list[chess.Move] = []
+        best_wdl = -2
+        best_dtm = 1_000_000
+        for index, move in enumerate(checks + captures + quiet_moves):
+            if stop_event.is_set():
+                raise TimeoutError
+
+            if best_wdl == 2 and (best_dtm == 0 or (best_dtm <= 2 and index >= len(checks))):
+                break
+
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    wdl = 2
+                    dtm = 0
+                else:
+                    dtm = -self.tablebase_manager.probe_dtm(self.gaviota_tablebase, board)
+                    wdl = self._value_to_wdl(dtm, board.halfmove_clock)
+            finally:
+                board.pop()
+
+            if best_moves:
+                if wdl > best_wdl:
+                    best_moves = [move]
+                    best_wdl = wdl
+                    best_dtm = dtm
+                elif wdl == best_wdl:
+                    if dtm < best_dtm:
+                        best_moves = [move]
+                        best_dtm = dtm
+                    elif dtm == best_dtm:
+                        best_moves.append(move)
+            else:
+                best_moves.append(move)
+                best_wdl = wdl
+                best_dtm = dtm
+
+        return Gaviota_Result(best_moves, best_wdl, best_dtm)
+
+    def _probe_syzygy(self,
+                      board: chess.Board,
+                      moves: list[chess.Move],
+                      stop_event: threading.Event) -> Syzygy_Result:
+        wdl_classes: defaultdict[int, list[chess.Move]] = defaultdict(list)
+        for move in moves:
+            if stop_event.is_set():
+                raise TimeoutError
+
+            board.push(move)
+            try:
+                wdl_classes[-self._probe_syzygy_cached(board, dtz=False)].append(move)
+            finally:
+                board.pop()
+
+        best_moves: list[chess.Move] = []
+        best_wdl = -2
+        best_dtz = 1_000_000
+        best_real_dtz = best_dtz
+        for raw_wdl in sorted(wdl_classes, reverse=True):
+            if best_moves and max(raw_wdl, -1) < best_wdl:
+                break
+
+            for move in wdl_classes[raw_wdl]:
+                if stop_event.is_set():
+                    raise TimeoutError
+
+                board.push(move)
+                try:
+                    dtz = -self._probe_syzygy_cached(board, dtz=True) if raw_wdl else 0
+                    halfmove_clock = board.halfmove_clock
+                finally:
+                    board.pop()
+
+                wdl = self._value_to_wdl(dtz, halfmove_clock)
+
+                real_dtz = dtz
+                if halfmove_clock == 0:
+                    if wdl < 0:
+                        dtz += 10_000
+                    elif wdl > 0:
+                        dtz -= 10_000
+
+                if best_moves:
+                    if wdl > best_wdl:
+                        best_moves = [move]
+                        best_wdl = wdl
+                        best_dtz = dtz
+                        best_real_dtz = real_dtz
+                    elif wdl == best_wdl:
+                        if dtz < best_dtz:
+                            best_moves = [move]
+                            best_dtz = dtz
+                            best_real_dtz = real_dtz
+                        elif dtz == best_dtz:
+                            best_moves.append(move)
+                else:
+                    best_moves.append(move)
+                    best_wdl = wdl
+                    best_dtz = dtz
+                    best_real_dtz = real_dtz
+
+        return Syzygy_Result(best_moves, best_wdl, best_real_dtz)
+
+    def _probe_syzygy_cached(self, board: chess.Board, dtz: bool) -> int:
+        assert self.syzygy_tablebase
+
+        key = (chess.polyglot.zobrist_hash(board), dtz)
+        if key in self.syzygy_cache:
+            self.syzygy_cache.move_to_end(key)
+            return self.syzygy_cache[key]
+
+        value = self.syzygy_tablebase.probe_dtz(board) if dtz else self.syzygy_tablebase.probe_wdl(board)
+        self.syzygy_cache[key] = value
+        if len(self.syzygy_cache) > SYZYGY_CACHE_SIZE:
+            self.syzygy_cache.popitem(last=False)
+
+        return value
+
+    def _get_syzygy_backend(self, board: chess.Board, engine: Engine) -> Literal['engine', 'python']:
+        if board.uci_variant != 'chess' or not engine.has_syzygy:
+            return 'python'
+
+        pieces = chess.popcount(board.occupied)
+        if pieces <= PYTHON_SYZYGY_MAX_PIECES or pieces > self.syzygy_config.max_pieces:
+            return 'python'
+
+        return 'engine'
+
+    async def _probe_syzygy_with_engine(self,
+                                        board: chess.Board,
+                                        moves: list[chess.Move],
+                                        engine: Engine,
+                                        timeout: float) -> Syzygy_Result:
+        engine.cancel_pondering()
+        infos = await asyncio.wait_for(engine.rank_root_moves(board, moves), timeout)
+        if not any(info.get('tbhits') for info in infos):
+            raise KeyError('The engine did not probe its tablebases.')
+
+        best_moves: list[chess.Move] = []
+        best_score = -1_000_000
+        for info in infos:
+            if 'pv' not in info or 'score' not in info:
+                continue
+
+            score = info['score'].relative.score(mate_score=100_000)
+            if score > best_score:
+                best_moves = [info['pv'][0]]
+                best_score = score
+            elif score == best_score:
+                best_moves.append(info['pv'][0])
+
+        if not best_moves:
+            raise KeyError('The engine did not rank any move.')
+
+        if best_score >= ENGINE_TB_WIN_SCORE:
+            wdl = 2
+        elif best_score <= -ENGINE_TB_WIN_SCORE:
+            wdl = -2
+        elif best_score == 0:
+            return Syzygy_Result(best_moves, 0, None)
+        else:
+            raise KeyError(f'The engine returned a non-tablebase score: {best_score}')
+
+        # The engine ranks its root moves by DTZ before searching, so the first move with the best score
+        # is also the fastest conversion among moves with equal tablebase scores.
+        return Syzygy_Result(best_moves[:1], wdl, None)
+
+    async def _run_probe(self,
+                         probe: Callable[[chess.Board, list[chess.Move], threading.Event], T],
+                         board: chess.Board,
+                         moves: Iterable[chess.Move],
+                         timeout: float,
+                         serial: bool = False) -> T:
+        self.stop_event = threading.Event()
+        return await self.tablebase_manager.probe(probe,
+                                                  board.copy(stack=False),
+                                                  list(moves),
+                                                  stop_event=self.stop_event,
+                                                  timeout=timeout,
+                                                  serial=serial)
+
+    @staticmethod
+    def _value_to_wdl(value: int, halfmove_clock: int) -> Literal[-2, -1, 0, 1, 2]:
+        if value > 0:
+            if value + halfmove_clock <= 100:
+                return 2
+
+            return 1
+
+        if value < 0:
+            if value - halfmove_clock >= -100:
+                return -2
+
+            return -1
+
+        return 0
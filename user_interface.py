@@ -1,5 +1,7 @@
 import argparse
 import asyncio
+import hashlib
+import json
 import logging
 import os
 import signal
@@ -7,9 +9,12 @@ import sys
 from enum import Enum
 from typing import TypeVar
 
+import psutil
+
 from api import API
 from botli_dataclasses import Challenge_Request
 from config import Config
+from configs import Engine_Config
 from engine import Engine
 from enums import Challenge_Color, Perf_Type, Variant
 from event_handler import Event_Handler
@@ -32,12 +37,14 @@ COMMANDS = {
     'quit': 'Exits the bot.',
     'rechallenge': 'Challenges the opponent to the last received challenge.',
     'reset': 'Resets matchmaking. Usage: reset PERF_TYPE',
+    'stats': 'Prints performance statistics.',
     'stop': 'Stops matchmaking mode.',
     'tournament': 'Joins tournament. Usage: tournament ID [TEAM] [PASSWORD]',
     'whitelist': 'Temporarily whitelists a user. Use config for permanent whitelisting. Usage: whitelist USERNAME'
 }
 
 EnumT = TypeVar('EnumT', bound=Enum)
+ENGINE_TEST_CACHE_PATH = '.engine_test_cache.json'
 
 
 class User_Interface:
@@ -53,11 +60,18 @@ class User_Interface:
         async with API(self.config) as self.api:
             print(f'{LOGO} {self.config.version}\n')
 
-            account = await self.api.get_account()
-            username: str = account['username']
-            self.api.append_user_agent(username)
-            await self._handle_bot_status(account.get('title'), allow_upgrade)
-            await self._test_engines()
+            engine_test_task = asyncio.create_task(self._test_engines())
+            try:
+                account = await self.api.get_account()
+                username: str = account['username']
+                self.api.append_user_agent(username)
+                await self._handle_bot_status(account.get('title'), allow_upgrade)
+            except BaseException:
+                engine_test_task.cancel()
+                await asyncio.gather(engine_test_task, return_exceptions=True)
+                raise
+
+            await engine_test_task
 
             self.game_manager = Game_Manager(self.api, self.config, username)
             self.game_manager_task = asyncio.create_task(self.game_manager.run())
@@ -107,6 +121,8 @@ class User_Interface:
                         self._rechallenge()
                     case 'reset':
                         self._reset(command)
+                    case 'stats':
+                        self._stats()
                     case 'stop':
                         self._stop()
                     case 'tournament':
@@ -148,10 +164,63 @@ class User_Interface:
             sys.exit(1)
 
     async def _test_engines(self) -> None:
+        engine_tests: dict[str, tuple[Engine_Config, list[str]]] = {}
         for engine_name, engine_config in self.config.engines.items():
-            print(f'Testing engine "{engine_name}" ... ', end='')
-            await Engine.test(engine_config)
-            print('OK')
+            test_key = self._get_engine_test_key(engine_config)
+            engine_tests.setdefault(test_key, (engine_config, []))[1].append(engine_name)
+
+        passed_test_keys = self._load_engine_test_cache()
+        for test_key, (_, engine_names) in engine_tests.items():
+            if test_key in passed_test_keys:
+                print(f'Engine test of "{", ".join(engine_names)}" skipped: Unchanged since last test.')
+
+        pending_test_keys = [test_key for test_key in engine_tests if test_key not in passed_test_keys]
+        for batch in self._get_engine_test_batches(pending_test_keys, engine_tests):
+            await asyncio.gather(*(self._test_engine(engine_tests[test_key][0], engine_tests[test_key][1])
+                                   for test_key in batch))
+
+        self._save_engine_test_cache(set(engine_tests) & (passed_test_keys | set(pending_test_keys)))
+
+    async def _test_engine(self, engine_config: Engine_Config, engine_names: list[str]) -> None:
+        await Engine.test(engine_config)
+        print(f'Engine test of "{", ".join(engine_names)}" OK')
+
+    def _get_engine_test_batches(self,
+                                 test_keys: list[str],
+                                 engine_tests: dict[str, tuple[Engine_Config, list[str]]]
+                                 ) -> list[list[str]]:
+        memory_limit = psutil.virtual_memory().available // 1_048_576 // 2
+        batches: list[list[str]] = []
+        batch_memory = 0
+        for test_key in test_keys:
+            hash_size = Engine.get_requested_hash_size(engine_tests[test_key][0])
+            if not batches or batch_memory + hash_size > memory_limit:
+                batches.append([])
+                batch_memory = 0
+
+            batches[-1].append(test_key)
+            batch_memory += hash_size
+
+        return batches
+
+    def _get_engine_test_key(self, engine_config: Engine_Config) -> str:
+        stat = os.stat(engine_config.path)
+        key_data = [os.path.realpath(engine_config.path), stat.st_mtime_ns, stat.st_size, engine_config.uci_options]
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def _load_engine_test_cache(self) -> set[str]:
+        try:
+            with open(ENGINE_TEST_CACHE_PATH, encoding='utf-8') as cache_file:
+                return set(json.load(cache_file))
+        except (OSError, json.JSONDecodeError, TypeError):
+            return set()
+
+    def _save_engine_test_cache(self, test_keys: set[str]) -> None:
+        try:
+            with open(ENGINE_TEST_CACHE_PATH, 'w', encoding='utf-8') as cache_file:
+                json.dump(sorted(test_keys), cache_file)
+        except OSError as e:
+            print(f'Engine test cache could not be saved: {e}')
 
     def _blacklist(self, command: list[str]) -> None:
         if len(command) != 2:
@@ -274,6 +343,18 @@ class User_Interface:
         self.game_manager.matchmaking.opponents.reset_release_time(perf_type)
         print('Matchmaking has been reset.')
 
+    def _stats(self) -> None:
+        print(self.game_manager.engine_pool)
+        print(self.game_manager.cpu_budget)
+        print(self.game_manager.memory_budget)
+        print(self.game_manager.book_registry)
+        print(self.game_manager.tablebase_manager)
+        print(self.game_manager.repertoire_prefetcher)
+        if self.api.response_cache:
+            print(self.api.response_cache)
+        print(f'Online requests: {self.api.online_requests}     Coalesced: {self.api.coalesced_requests}')
+        print(self.api.source_health)
+
     def _stop(self) -> None:
         if self.game_manager.stop_matchmaking():
             print('Stopping matchmaking ...')